@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Time of the "all screens are blank" check of the PyQt capture fallback.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_blank_screen.py
+#
+# A normal screenshot is rejected by the sparse sample grid, a blank one is
+# scanned in full. The former per-pixel Python loop is timed at 1080p only.
+
+import sys
+import time
+from itertools import groupby
+from statistics import median
+
+from common import RESOLUTIONS
+from screenpen.screenpen import QtGui, QApplication, IMAGE_FORMATS, _are_blank
+
+REPEAT = 5
+
+
+def screenshot(width, height, blank):
+    image = QtGui.QImage(width, height, IMAGE_FORMATS['ARGB32'])
+    image.fill(0xff000000)
+    if not blank:
+        qp = QtGui.QPainter(image)
+        qp.fillRect(width // 3, height // 3, width // 3, height // 3, QtGui.QColor(40, 90, 160))
+        qp.end()
+    return image
+
+
+def per_pixel(images):
+    pxls = [img.pixel(i, j) for img in images for i in range(img.width()) for j in range(img.height())]
+    return [next(g, f := next(g, g)) == f for g in [groupby(pxls)]][0]
+
+
+def timed(check, images):
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        check(images)
+        times.append(time.perf_counter() - t0)
+    return median(times)
+
+
+def main():
+    app = QApplication(sys.argv)
+    print(f'{"resolution":>10} {"screen":>8} {"ms":>10}')
+    for name, (width, height) in RESOLUTIONS.items():
+        for blank in (False, True):
+            images = [screenshot(width, height, blank)]
+            assert _are_blank(images) == blank
+            label = 'blank' if blank else 'normal'
+            print(f'{name:>10} {label:>8} {timed(_are_blank, images)*1000:10.3f}')
+    images = [screenshot(1920, 1080, True)]
+    t0 = time.perf_counter()
+    per_pixel(images)
+    print(f'{"1080p":>10} {"blank":>8} {(time.perf_counter() - t0)*1000:10.3f}  (per-pixel loop)')
+
+
+if __name__ == '__main__':
+    main()
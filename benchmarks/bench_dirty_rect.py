@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Frame time of a freehand stroke at different screen resolutions.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_dirty_rect.py
+#
+# Every mouse move repaints only the area touched by the pen, so the time per
+# frame should stay roughly the same for 1080p, 4K and 8K.
+
+import sys
+import time
+from statistics import median
+
+from common import RESOLUTIONS, mouse_event, open_window
+from screenpen.screenpen import QtCore, QApplication
+
+MOVES = 300
+
+
+def run(app, width, height):
+    window = open_window(app, width, height)
+    left = QtCore.Qt.MouseButton.LeftButton
+    start = QtCore.QPoint(width // 4, height // 2)
+    QApplication.sendEvent(window, mouse_event(QtCore.QEvent.Type.MouseButtonPress, start, left))
+    app.processEvents()
+    frames = []
+    for i in range(MOVES):
+        pos = QtCore.QPoint(start.x() + 2*i, start.y() + (i % 20) * 3)
+        t0 = time.perf_counter()
+        QApplication.sendEvent(window, mouse_event(QtCore.QEvent.Type.MouseMove, pos, QtCore.Qt.MouseButton.NoButton))
+        # one display frame per move, the frame timer would batch them
+        window._frameTick()
+        app.processEvents()
+        frames.append(time.perf_counter() - t0)
+    QApplication.sendEvent(window, mouse_event(QtCore.QEvent.Type.MouseButtonRelease, pos, left))
+    app.processEvents()
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return frames
+
+
+def main():
+    app = QApplication(sys.argv)
+    print(f'{"resolution":>10} {"median ms":>10} {"max ms":>10}')
+    for name, (width, height) in RESOLUTIONS.items():
+        frames = run(app, width, height)
+        print(f'{name:>10} {median(frames)*1000:10.3f} {max(frames)*1000:10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# Drawing throughput of every tool at different screen resolutions.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_drawing.py
+#   python benchmarks/bench_drawing.py --json results.json
+#   python benchmarks/bench_drawing.py --baseline results.json
+#
+# Synthetic press/move/release streams are sent to ScreenPenWindow for each
+# tool and as tablet events with varying pressure for ink (drawInk),
+# followed by undo/redo of everything drawn. Every resolution runs in
+# its own process so the peak RSS belongs to that resolution only. Events/sec
+# counts the mouse events (or undo/redo steps) handled per second, including
+# the repaints they cause; paint times are measured around paintEvent.
+# Moves arrive faster than the display refreshes, a frame is forced every
+# --moves-per-frame moves (4 is a 240 Hz mouse on a 60 Hz screen).
+#
+# --json writes the results for tracking regressions between releases,
+# --baseline prints the change of events/sec and p99 against such a file.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from common import ROOT, RESOLUTIONS, mouse_event, open_window
+
+TOOLS = ('drawPath', 'drawEraser', 'drawRect', 'drawLine', 'drawDot', 'drawChart', 'drawInk')
+STROKES = 20
+MOVES = 100
+MOVES_PER_FRAME = 4
+CHART = '''
+fig = Figure(figsize=(3, 2))
+fig.add_subplot().plot(np.arange(10), np.arange(10) ** 2)
+'''
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def peak_rss():
+    '''Peak resident set size of this process in bytes (None if unknown).'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_resolution(name, strokes, moves, moves_per_frame):
+    from screenpen.screenpen import (
+        QtCore, QtGui, QApplication, ScreenPenWindow, _render_chart, _logical_size, pyqt_version
+    )
+
+    paints = []
+
+    class TimedWindow(ScreenPenWindow):
+        def paintEvent(self, event):
+            t0 = time.perf_counter()
+            super().paintEvent(event)
+            paints.append(time.perf_counter() - t0)
+
+    def tablet_event(kind, pos, button, pressure):
+        buttons = QtCore.Qt.MouseButton.NoButton if kind == QtCore.QEvent.Type.TabletRelease else QtCore.Qt.MouseButton.LeftButton
+        modifiers = QtCore.Qt.KeyboardModifier.NoModifier
+        if pyqt_version == 6:
+            return QtGui.QTabletEvent(kind, QtGui.QPointingDevice.primaryPointingDevice(), QtCore.QPointF(pos),
+                                      QtCore.QPointF(pos), pressure, 0, 0, 0, 0, 0, modifiers, button, buttons)
+        return QtGui.QTabletEvent(kind, QtCore.QPointF(pos), QtCore.QPointF(pos), QtGui.QTabletEvent.Stylus,
+                                  QtGui.QTabletEvent.Pen, pressure, 0, 0, 0, 0, 0, modifiers, 1, button, buttons)
+
+    def send(event, frame=True):
+        QApplication.sendEvent(window, event)
+        if frame:
+            window._frameTick()
+            app.processEvents()
+
+    def measure(steps):
+        '''Runs the callables in `steps` and returns the scenario result.'''
+        paints.clear()
+        t0 = time.perf_counter()
+        for step in steps:
+            step()
+        seconds = time.perf_counter() - t0
+        return {
+            'events': len(steps),
+            'seconds': seconds,
+            'events_per_sec': len(steps) / seconds,
+            'paints': len(paints),
+            'paint_p50_ms': percentile(paints, 50) * 1000 if paints else None,
+            'paint_p99_ms': percentile(paints, 99) * 1000 if paints else None,
+        }
+
+    def stroke_events(tool, i):
+        # strokes are spread over the screen, away from the toolbars
+        x0 = width // 8 + (i * width // (2 * strokes))
+        y0 = height // 4 + (i * 37) % (height // 2)
+        left, no_button = QtCore.Qt.MouseButton.LeftButton, QtCore.Qt.MouseButton.NoButton
+        points = [QtCore.QPoint(x0 + 3*j, y0 + (j % 20) * 4) for j in range(moves + 1)]
+        if tool == 'drawInk':
+            types = QtCore.QEvent.Type.TabletPress, QtCore.QEvent.Type.TabletMove, QtCore.QEvent.Type.TabletRelease
+            pressures = [0.2 + 0.8 * (j % 40) / 40 for j in range(moves + 1)]
+            events = [tablet_event(types[0], points[0], left, pressures[0])]
+            events += [tablet_event(types[1], p, no_button, pr) for p, pr in zip(points[1:], pressures[1:])]
+            events.append(tablet_event(types[2], points[-1], left, 0.0))
+            return [lambda event=event, frame=(j % moves_per_frame == 0 or j == len(events) - 1): send(event, frame)
+                    for j, event in enumerate(events)]
+        events = [mouse_event(QtCore.QEvent.Type.MouseButtonPress, points[0], left)]
+        events += [mouse_event(QtCore.QEvent.Type.MouseMove, p, no_button) for p in points[1:]]
+        events.append(mouse_event(QtCore.QEvent.Type.MouseButtonRelease, points[-1], left))
+        return [lambda event=event, frame=(j % moves_per_frame == 0 or j == len(events) - 1): send(event, frame)
+                for j, event in enumerate(events)]
+
+    width, height = RESOLUTIONS[name]
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = open_window(app, width, height, TimedWindow)
+
+    results = {}
+    for tool in TOOLS:
+        if tool == 'drawEraser':
+            window.setEraser()()
+        elif tool == 'drawInk':
+            window.setAction('drawPath')()
+        else:
+            window.setAction(tool)()
+        if tool == 'drawChart':
+            window._chart_image = _render_chart(CHART, window.devicePixelRatioF())
+            window._chart_size = _logical_size(window._chart_image)
+        results[tool] = measure([step for i in range(strokes) for step in stroke_events(tool, i)])
+    drawn = strokes * len(TOOLS)
+    results['undo'] = measure([lambda: (window.undo(), app.processEvents())] * drawn)
+    results['redo'] = measure([lambda: (window.redo(), app.processEvents())] * drawn)
+    window.close()
+    return {'width': width, 'height': height, 'qt': QtCore.qVersion(), 'peak_rss': peak_rss(), 'scenarios': results}
+
+
+def run_child(name, strokes, moves, moves_per_frame):
+    '''Runs one resolution in a fresh interpreter and returns its results.'''
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name, '--strokes', str(strokes),
+           '--moves', str(moves), '--moves-per-frame', str(moves_per_frame)]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, cwd=ROOT).stdout
+    # screenpen prints the Qt binding it picked, the results are the last line
+    return json.loads(out.splitlines()[-1])
+
+
+def print_results(results, baseline=None):
+    header = f'{"resolution":>10} {"scenario":>10} {"events/s":>10} {"p50 ms":>8} {"p99 ms":>8}'
+    print(header + (f' {"events/s":>9} {"p99":>9}' if baseline else ''))
+    for name, res in results['resolutions'].items():
+        for scenario, r in res['scenarios'].items():
+            p50, p99 = r['paint_p50_ms'] or 0, r['paint_p99_ms'] or 0
+            line = f'{name:>10} {scenario:>10} {r["events_per_sec"]:10.0f} {p50:8.2f} {p99:8.2f}'
+            old = (baseline or {}).get('resolutions', {}).get(name, {}).get('scenarios', {}).get(scenario)
+            if old:
+                line += f' {r["events_per_sec"] / old["events_per_sec"] - 1:+9.1%}'
+                if old['paint_p99_ms'] and r['paint_p99_ms']:
+                    line += f' {r["paint_p99_ms"] / old["paint_p99_ms"] - 1:+9.1%}'
+            print(line)
+        if res['peak_rss'] is not None:
+            print(f'{name:>10} {"peak RSS":>10} {res["peak_rss"] / 2**20:10.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drawing benchmark of screenpen.')
+    parser.add_argument('--resolutions', nargs='+', choices=RESOLUTIONS, default=list(RESOLUTIONS))
+    parser.add_argument('--strokes', type=int, default=STROKES, help='strokes per tool')
+    parser.add_argument('--moves', type=int, default=MOVES, help='mouse moves per stroke')
+    parser.add_argument('--moves-per-frame', type=int, default=MOVES_PER_FRAME, help='mouse moves per display frame')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE (- for stdout)')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with results written by --json')
+    parser.add_argument('--child', choices=RESOLUTIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_resolution(args.child, args.strokes, args.moves, args.moves_per_frame)))
+        return
+
+    resolutions = {name: run_child(name, args.strokes, args.moves, args.moves_per_frame) for name in args.resolutions}
+    results = {
+        'python': platform.python_version(),
+        'qt': next(iter(resolutions.values()))['qt'],
+        'platform': platform.platform(),
+        'strokes': args.strokes,
+        'moves': args.moves,
+        'moves_per_frame': args.moves_per_frame,
+        'resolutions': resolutions,
+    }
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        return
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    print_results(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Time from the start of the program to the first paint of the window.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_startup.py
+#
+# The "eager" row imports NumPy and Matplotlib up front like screenpen used
+# to do, the "lazy" row is the current startup path.
+
+import os
+import subprocess
+import sys
+from statistics import median
+
+RUNS = 5
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import os, sys, time
+t0 = time.perf_counter()
+{preload}
+from screenpen import screenpen as sp
+app = sp.QApplication(sys.argv)
+paintEvent = sp.ScreenPenWindow.paintEvent
+def firstPaint(self, event):
+    paintEvent(self, event)
+    print(time.perf_counter() - t0, 'matplotlib' in sys.modules, flush=True)
+    os._exit(0)
+sp.ScreenPenWindow.paintEvent = firstPaint
+screen = app.screens()[0]
+window = sp.ScreenPenWindow(screen=screen, screen_geom=screen.geometry(), transparent_background=True)
+sp._execute_dialog(app)
+'''
+
+VARIANTS = {
+    'eager': 'import numpy, matplotlib.figure, matplotlib.backends.backend_qt5agg',
+    'lazy': '',
+}
+
+
+def run(preload):
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD.format(preload=preload)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+    ).stdout.decode().split()
+    return float(out[-2]), out[-1] == 'True'
+
+
+def main():
+    print(f'{"variant":>8} {"median ms":>10} {"matplotlib loaded":>18}')
+    for name, preload in VARIANTS.items():
+        results = [run(preload) for _ in range(RUNS)]
+        print(f'{name:>8} {median(t for t, _ in results)*1000:10.1f} {str(results[-1][1]):>18}')
+
+
+if __name__ == '__main__':
+    main()
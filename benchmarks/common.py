@@ -0,0 +1,37 @@
+# Helpers shared by the benchmarks, import it before screenpen: it selects
+# the offscreen platform and puts the repository on sys.path.
+
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+RESOLUTIONS = {
+    '1080p': (1920, 1080),
+    '4K': (3840, 2160),
+    '8K': (7680, 4320),
+}
+
+
+def mouse_event(kind, pos, button):
+    from screenpen.screenpen import QtCore, QtGui
+    return QtGui.QMouseEvent(
+        kind, QtCore.QPointF(pos), QtCore.QPointF(pos), button,
+        QtCore.Qt.MouseButton.LeftButton, QtCore.Qt.KeyboardModifier.NoModifier
+    )
+
+
+def open_window(app, width, height, window_class=None):
+    '''ScreenPenWindow (or `window_class`) of `width` x `height` with a transparent background.'''
+    from screenpen.screenpen import QtCore, ScreenPenWindow
+    window = (window_class or ScreenPenWindow)(
+        screen=app.screens()[0], screen_geom=QtCore.QRect(0, 0, width, height), transparent_background=True
+    )
+    # the offscreen platform has a single 800x600 screen, undo the fullscreen resize
+    window.showNormal()
+    window.setGeometry(QtCore.QRect(0, 0, width, height))
+    app.processEvents()
+    assert window.size() == QtCore.QSize(width, height), window.size()
+    return window
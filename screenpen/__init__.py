@@ -1,3 +1,4 @@
-from screenpen.screenpen import main
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+def main():
+    # imported on call, so that worker processes can import screenpen.recording without Qt
+    from screenpen.screenpen import main
+    return main()
\ No newline at end of file
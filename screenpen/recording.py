@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+'''Frame encoding for screen recordings. It runs in worker processes, so it
+must not import Qt (or anything else that imports screenpen.screenpen).'''
+
+import os
+import struct
+import sys
+import zlib
+from multiprocessing import shared_memory
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _rgba(pixels, width, height, stride):
+    '''RGBA bytes of ARGB32 (native endian 0xAARRGGBB words) `pixels`.'''
+    import numpy as np
+    argb = np.frombuffer(pixels, np.uint8, height*stride).reshape(height, stride)[:, :4*width]
+    order = (2, 1, 0, 3) if sys.byteorder == 'little' else (1, 2, 3, 0)
+    return argb.reshape(height, width, 4)[:, :, order].tobytes()
+
+
+def encode_png(fp, pixels, width, height, stride, level=1):
+    '''Writes ARGB32 `pixels` (rows of `stride` bytes) to `fp` as RGBA PNG.'''
+    rgba = _rgba(pixels, width, height, stride)
+    rows = zlib.compressobj(level)
+    idat = []
+    for y in range(height):
+        # filter type 0 (None) per row
+        idat.append(rows.compress(b'\x00' + rgba[y*4*width:(y+1)*4*width]))
+    idat.append(rows.flush())
+    fp.write(PNG_SIGNATURE)
+    fp.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+    fp.write(_chunk(b'IDAT', b''.join(idat)))
+    fp.write(_chunk(b'IEND', b''))
+
+
+def lower_priority():
+    '''Pool initializer, encoding should not take CPU time from drawing.'''
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def warm_up():
+    '''Imports what encoding needs, so the first frames are not late.'''
+    import numpy  # noqa: F401
+
+
+def _attach(name):
+    # the recorder owns the block, this process must not unlink it; before
+    # Python 3.13 attaching registers it with the resource tracker the pool
+    # shares with the recorder, which is harmless
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+def encode_frame(shm_name, width, height, stride, path, level=1):
+    '''Encodes the frame in shared memory block `shm_name` into `path`.'''
+    shm = _attach(shm_name)
+    try:
+        with open(f'{path}.tmp', 'wb') as fp:
+            encode_png(fp, shm.buf, width, height, stride, level)
+        os.replace(f'{path}.tmp', path)
+    finally:
+        shm.close()
+    return path
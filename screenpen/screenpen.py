@@ -7,7 +7,8 @@
 
 #from .version import __version__  # noqa: F401,E402
 
-import pkg_resources
+import time
+_IMPORT_STARTED = time.perf_counter()
 
 try:
     import PyQt5
@@ -28,26 +29,55 @@ except ImportError:
         exit(1)
 
 
-try:
-    pkg_resources.get_distribution("PySide6")
-    print('\033[41m', end='')
-    print('=========================> WARNING <===========================')
-    print('>       PySide6 is installed but PyQt5 only is expected.      <')
-    print('>          Errors may appear. Please remove PySide6.          <')
-    print('===============================================================\033[0m')
-except pkg_resources.DistributionNotFound:
-    pass
-
+import atexit
+import base64
+import ctypes
+import math
+import queue
+import shutil
+import struct
 import subprocess
 import sys
+import threading
+import zlib
 from datetime import datetime
 import configparser
-from itertools import groupby
+import json
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+import functools
+import hashlib
+import textwrap
+from array import array
+
+
+class _LazyTable(Mapping):
+    '''Compatibility table that is built on the first lookup.'''
+    def __init__(self, build):
+        self._build = build
+        self._table = None
+
+    def _get_table(self):
+        if self._table is None:
+            self._table = self._build()
+        return self._table
+
+    def __getitem__(self, key):
+        return self._get_table()[key]
+
+    def __iter__(self):
+        return iter(self._get_table())
+
+    def __len__(self):
+        return len(self._get_table())
+
 
 if pyqt_version == 5:
     from PyQt5 import QtGui
     from PyQt5 import QtWidgets
     from PyQt5 import QtCore
+    from PyQt5 import sip
     from PyQt5.QtWidgets import QMainWindow, QApplication, QDesktopWidget
     from PyQt5.QtCore import QPoint, Qt, QSize
     from PyQt5.QtWidgets import QToolBar, QAction, QDialog, QToolButton, QMenu, QColorDialog
@@ -67,7 +97,7 @@ if pyqt_version == 5:
     def _create_palette():
         return QPalette()
     
-    PALETTE_PROPS = {
+    PALETTE_PROPS = _LazyTable(lambda: {
         'window': QPalette.Window,
         'windowText': QPalette.WindowText,
         'base': QPalette.Base,
@@ -81,7 +111,7 @@ if pyqt_version == 5:
         'link': QPalette.Link,
         'highlight': QPalette.Highlight,
         'highlightedText': QPalette.HighlightedText,
-    }
+    })
 
     def _get_color_from_RGB(r, g, b):
         return QColor(r, g, b)
@@ -91,13 +121,13 @@ if pyqt_version == 5:
     
     # _set_palette_color(_create_palette(), PALETTE_PROPS['window'], _get_color_from_RGB(53, 53, 53))
     
-    ALIGNMENT = {
+    ALIGNMENT = _LazyTable(lambda: {
         'center': QtCore.Qt.AlignCenter,
         'left': QtCore.Qt.AlignLeft,
         'right': QtCore.Qt.AlignRight,
-    }
+    })
 
-    COLORS = {
+    COLORS = _LazyTable(lambda: {
         'black': Qt.black,
         'white': Qt.white,
         'red': Qt.red,
@@ -116,20 +146,33 @@ if pyqt_version == 5:
         'darkCyan': Qt.darkCyan,
         'darkMagenta': Qt.darkMagenta,
         'darkYellow': Qt.darkYellow,
-    }
+    })
 
     def _execute_dialog(dlg):
         return dlg.exec_()
     
-    WINDOW_ATTRS = {
+    WINDOW_ATTRS = _LazyTable(lambda: {
         'translucentBackground': QtCore.Qt.WA_TranslucentBackground,
-    }
+        'opaquePaintEvent': QtCore.Qt.WA_OpaquePaintEvent,
+        'transparentForMouseEvents': QtCore.Qt.WA_TransparentForMouseEvents,
+    })
+
+    APP_ATTRS = _LazyTable(lambda: {
+        'compressHighFrequencyEvents': QtCore.Qt.AA_CompressHighFrequencyEvents,
+    })
 
-    IMAGE_FORMATS = {
+    IMAGE_FORMATS = _LazyTable(lambda: {
         'ARGB32': QtGui.QImage.Format_ARGB32,
-    }
+        'ARGB32_Premultiplied': QtGui.QImage.Format_ARGB32_Premultiplied,
+        'RGB888': QtGui.QImage.Format_RGB888,
+        'RGB32': QtGui.QImage.Format_RGB32,
+    })
 
-    PEN_STYLES = {
+    TRANSFORMATIONS = _LazyTable(lambda: {
+        'smooth': Qt.SmoothTransformation,
+    })
+
+    PEN_STYLES = _LazyTable(lambda: {
         'solidLine': Qt.SolidLine,
         'dashLine': Qt.DashLine,
         'dotLine': Qt.DotLine,
@@ -138,65 +181,88 @@ if pyqt_version == 5:
         'squareCap': Qt.SquareCap,
         'flatCap': Qt.FlatCap,
         'roundJoin': Qt.RoundJoin,
-    }
+        'noPen': Qt.NoPen,
+    })
 
-    TOOLBAR_AREAS = {
+    TOOLBAR_AREAS = _LazyTable(lambda: {
         'leftToolBarArea': Qt.LeftToolBarArea,
         'rightToolBarArea': Qt.RightToolBarArea,
         'topToolBarArea': Qt.TopToolBarArea,
         'bottomToolBarArea': Qt.BottomToolBarArea,
-    }
+    })
 
-    TOOL_BUTTON_STYLE = {
+    TOOL_BUTTON_STYLE = _LazyTable(lambda: {
         'toolButtonIconOnly': Qt.ToolButtonIconOnly,
-    }
+    })
 
-    POPUP_MODE = {
+    POPUP_MODE = _LazyTable(lambda: {
         'instantPopup': QToolButton.InstantPopup
-    }
+    })
 
-    COMPOSITION_MODE = {
+    COMPOSITION_MODE = _LazyTable(lambda: {
         'source': QtGui.QPainter.CompositionMode_Source,
         'source_over': QtGui.QPainter.CompositionMode_SourceOver,
-    }
+    })
 
-    BUTTONS = {
+    BUTTONS = _LazyTable(lambda: {
         'left': Qt.LeftButton,
         'right': Qt.RightButton,
         'middle': Qt.MiddleButton,
-    }
+    })
 
-    BRUSHES = {
+    BRUSHES = _LazyTable(lambda: {
         'no_brush': Qt.NoBrush,
-    }
+    })
+
+    PAGE_SIZE_UNITS = _LazyTable(lambda: {
+        'point': QtGui.QPageSize.Point,
+    })
 
-    CURSORS = {
+    TIMER_TYPES = _LazyTable(lambda: {
+        'precise': Qt.PreciseTimer,
+    })
+
+    EVENT_TYPES = _LazyTable(lambda: {
+        'tabletPress': QtCore.QEvent.TabletPress,
+        'tabletMove': QtCore.QEvent.TabletMove,
+        'tabletRelease': QtCore.QEvent.TabletRelease,
+    })
+
+    OPEN_MODES = _LazyTable(lambda: {
+        'writeOnly': QtCore.QIODevice.WriteOnly,
+    })
+
+    CURSORS = _LazyTable(lambda: {
         'arrow_cursor': Qt.ArrowCursor,
-    }
+    })
 
-    KEYS = {
+    KEYS = _LazyTable(lambda: {
         'escape': Qt.Key_Escape,
         'enter': Qt.Key_Enter,
         'return': Qt.Key_Return,
         'shift': Qt.Key_Shift,
-    }
+    })
 
     def _path_move_to(path, point):
         return path.moveTo(point)
+
+    def _event_pos_f(event):
+        return event.posF()
     
     def _path_cubic_to(path, point1, point2, point3):
         return path.cubicTo(point1, point2, point3)
     
-    DIALOG_BUTTONS = {
+    DIALOG_BUTTONS = _LazyTable(lambda: {
         'ok': QDialogButtonBox.Ok,
         'cancel': QDialogButtonBox.Cancel,
-    }
+    })
 
 
 elif pyqt_version == 6:
     from PyQt6 import QtGui
     from PyQt6 import QtWidgets
     from PyQt6 import QtCore
+    from PyQt6 import sip
     from PyQt6.QtWidgets import QMainWindow, QApplication #, QDesktopWidget
     from PyQt6.QtCore import QPoint, Qt, QSize
     from PyQt6.QtWidgets import QToolBar, QDialog, QToolButton, QMenu, QColorDialog
@@ -218,7 +284,7 @@ elif pyqt_version == 6:
     def _create_palette():
         return QPalette()
 
-    PALETTE_PROPS = {
+    PALETTE_PROPS = _LazyTable(lambda: {
         'window': 'window',
         'windowText': 'windowText',
         'base': 'base',
@@ -232,7 +298,7 @@ elif pyqt_version == 6:
         'link': 'link',
         'highlight': 'highlight',
         'highlightedText': 'highlightedText',
-    }
+    })
 
 
     def _get_color_from_RGB(r, g, b):
@@ -243,13 +309,13 @@ elif pyqt_version == 6:
 
     # _set_palette_color(_create_palette(), PALETTE_PROPS['window'], _get_color_from_RGB(53, 53, 53))
 
-    ALIGNMENT = {
+    ALIGNMENT = _LazyTable(lambda: {
         'center': Qt.AlignmentFlag.AlignCenter,
         'left': Qt.AlignmentFlag.AlignLeft,
         'right': Qt.AlignmentFlag.AlignRight,
-    }
+    })
 
-    COLORS = {
+    COLORS = _LazyTable(lambda: {
         'black': QtGui.QColorConstants.Black,
         'white': QtGui.QColorConstants.White,
         'red': QtGui.QColorConstants.Red,
@@ -268,20 +334,33 @@ elif pyqt_version == 6:
         'darkCyan': QtGui.QColorConstants.DarkCyan,
         'darkMagenta': QtGui.QColorConstants.DarkMagenta,
         'darkYellow': QtGui.QColorConstants.DarkYellow,
-    }
+    })
 
     def _execute_dialog(dlg):
         return dlg.exec()
     
-    WINDOW_ATTRS = {
+    WINDOW_ATTRS = _LazyTable(lambda: {
         'translucentBackground': QtCore.Qt.WidgetAttribute.WA_TranslucentBackground,
-    }
+        'opaquePaintEvent': QtCore.Qt.WidgetAttribute.WA_OpaquePaintEvent,
+        'transparentForMouseEvents': QtCore.Qt.WidgetAttribute.WA_TransparentForMouseEvents,
+    })
+
+    APP_ATTRS = _LazyTable(lambda: {
+        'compressHighFrequencyEvents': QtCore.Qt.ApplicationAttribute.AA_CompressHighFrequencyEvents,
+    })
     
-    IMAGE_FORMATS = {
+    IMAGE_FORMATS = _LazyTable(lambda: {
         'ARGB32': QtGui.QImage.Format.Format_ARGB32,
-    }
+        'ARGB32_Premultiplied': QtGui.QImage.Format.Format_ARGB32_Premultiplied,
+        'RGB888': QtGui.QImage.Format.Format_RGB888,
+        'RGB32': QtGui.QImage.Format.Format_RGB32,
+    })
 
-    PEN_STYLES = {
+    TRANSFORMATIONS = _LazyTable(lambda: {
+        'smooth': QtCore.Qt.TransformationMode.SmoothTransformation,
+    })
+
+    PEN_STYLES = _LazyTable(lambda: {
         'solidLine': QtCore.Qt.PenStyle.SolidLine,
         'dashLine': QtCore.Qt.PenStyle.DashLine,
         'dotLine': QtCore.Qt.PenStyle.DotLine,
@@ -290,52 +369,74 @@ elif pyqt_version == 6:
         'squareCap': QtCore.Qt.PenCapStyle.SquareCap,
         'flatCap': QtCore.Qt.PenCapStyle.FlatCap,
         'roundJoin': QtCore.Qt.PenJoinStyle.RoundJoin,
-    }
+        'noPen': QtCore.Qt.PenStyle.NoPen,
+    })
 
-    TOOLBAR_AREAS = {
+    TOOLBAR_AREAS = _LazyTable(lambda: {
         'leftToolBarArea': Qt.ToolBarArea.LeftToolBarArea,
         'rightToolBarArea': Qt.ToolBarArea.RightToolBarArea,
         'topToolBarArea': Qt.ToolBarArea.TopToolBarArea,
         'bottomToolBarArea': Qt.ToolBarArea.BottomToolBarArea,
-    }
+    })
 
-    TOOL_BUTTON_STYLE = {
+    TOOL_BUTTON_STYLE = _LazyTable(lambda: {
         'toolButtonIconOnly': QtCore.Qt.ToolButtonStyle.ToolButtonIconOnly,
-    }
+    })
 
-    POPUP_MODE = {
+    POPUP_MODE = _LazyTable(lambda: {
         'instantPopup': QtWidgets.QToolButton.ToolButtonPopupMode.InstantPopup
-    }
+    })
 
-    COMPOSITION_MODE = {
+    COMPOSITION_MODE = _LazyTable(lambda: {
         'source': QtGui.QPainter.CompositionMode.CompositionMode_Source,
         'source_over': QtGui.QPainter.CompositionMode.CompositionMode_SourceOver,
-    }
+    })
 
-    BUTTONS = {
+    BUTTONS = _LazyTable(lambda: {
         'left': QtCore.Qt.MouseButton.LeftButton,
         'right': QtCore.Qt.MouseButton.RightButton,
         'middle': QtCore.Qt.MouseButton.MiddleButton,
-    }
+    })
 
-    BRUSHES = {
+    BRUSHES = _LazyTable(lambda: {
         'no_brush': QtCore.Qt.BrushStyle.NoBrush,
-    }
+    })
+
+    PAGE_SIZE_UNITS = _LazyTable(lambda: {
+        'point': QtGui.QPageSize.Unit.Point,
+    })
+
+    TIMER_TYPES = _LazyTable(lambda: {
+        'precise': QtCore.Qt.TimerType.PreciseTimer,
+    })
+
+    EVENT_TYPES = _LazyTable(lambda: {
+        'tabletPress': QtCore.QEvent.Type.TabletPress,
+        'tabletMove': QtCore.QEvent.Type.TabletMove,
+        'tabletRelease': QtCore.QEvent.Type.TabletRelease,
+    })
 
-    CURSORS = {
+    OPEN_MODES = _LazyTable(lambda: {
+        'writeOnly': QtCore.QIODevice.OpenModeFlag.WriteOnly,
+    })
+
+    CURSORS = _LazyTable(lambda: {
         'arrow_cursor': QtCore.Qt.CursorShape.ArrowCursor,
-    }
+    })
 
-    KEYS = {
+    KEYS = _LazyTable(lambda: {
         'escape': QtCore.Qt.Key.Key_Escape,
         'enter': QtCore.Qt.Key.Key_Enter,
         'return': QtCore.Qt.Key.Key_Return,
         'shift': QtCore.Qt.Key.Key_Shift,
-    }
+    })
 
     def _path_move_to(path, point):
         path.moveTo(point.x(), point.y())
 
+    def _event_pos_f(event):
+        return event.position()
+
     def _path_cubic_to(path, point1, point2, point3):
         return path.cubicTo(
             point1.x(), point1.y(), 
@@ -343,41 +444,1491 @@ elif pyqt_version == 6:
             point3.x(), point3.y(), 
         )
     
-    DIALOG_BUTTONS = {
+    DIALOG_BUTTONS = _LazyTable(lambda: {
         'ok': QDialogButtonBox.StandardButton.Ok,
         'cancel': QDialogButtonBox.StandardButton.Cancel,
-    }
+    })
     
 
-import numpy as np
 import platform
 from datetime import datetime
-from xml.dom import minidom
+import marshal
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
 import os
 from types import SimpleNamespace
 import importlib
-
-from matplotlib.backends.qt_compat import QtCore, QtWidgets
-if QtCore.qVersion() >= "5.":
-    from matplotlib.backends.backend_qt5agg import (
-        FigureCanvas, NavigationToolbar2QT as NavigationToolbar)
-else:
-    from matplotlib.backends.backend_qt4agg import (
-        FigureCanvas, NavigationToolbar2QT as NavigationToolbar)
-from matplotlib.figure import Figure
+import importlib.util
 
 from screenpen.version import __version__
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
-syntax_py_path = f'{dir_path}/utils/syntax.py'
-spec = importlib.util.spec_from_file_location('syntax', syntax_py_path)
-syntax = importlib.util.module_from_spec(spec)
-sys.modules['syntax'] = syntax
-spec.loader.exec_module(syntax)
+def _warn_if_pyside6():
+    if importlib.util.find_spec('PySide6') is None:
+        return
+    print('\033[41m', end='')
+    print('=========================> WARNING <===========================')
+    print('>       PySide6 is installed but PyQt5 only is expected.      <')
+    print('>          Errors may appear. Please remove PySide6.          <')
+    print('===============================================================\033[0m')
+
+
+@functools.lru_cache(maxsize=None)
+def _load_syntax():
+    # the highlighter is needed only by the chart dialog
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    syntax_py_path = f'{dir_path}/utils/syntax.py'
+    spec = importlib.util.spec_from_file_location('syntax', syntax_py_path)
+    syntax = importlib.util.module_from_spec(spec)
+    sys.modules['syntax'] = syntax
+    spec.loader.exec_module(syntax)
+    return syntax
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    # distance of point p from the line segment a-b
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else min(max(((px - ax) * dx + (py - ay) * dy) / length2, 0.0), 1.0)
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+class StrokeEngine(object):
+    '''Turns the mouse samples of a freehand stroke into a few smooth
+    segments, so every mouse move rasterizes at most the newest pieces of
+    the stroke and the scene stores only their vertices.
+
+    Samples closer than `min_distance` to the previous one are dropped. The
+    others collect in a sliding window of up to WINDOW samples that stays a
+    single line from the last vertex while every sample in it is within
+    `tolerance` of that line (Ramer-Douglas-Peucker, online). Vertices are
+    joined by Catmull-Rom splines drawn as cubic Béziers; a segment is final
+    once the vertex after its end is known, `tail` is the part of the stroke
+    that may still change.
+
+    Segments are stroked with the round cap of the pen, which gives the same
+    round join to the previous segment as stroking the path in one go.
+    '''
+    WINDOW = 32
+
+    def __init__(self, min_distance=2.0, tolerance=1.0):
+        self.min_distance = min_distance
+        self.tolerance = tolerance
+        self.begin(QtCore.QPointF())
+
+    def begin(self, point):
+        self.points = array('f', [point.x(), point.y()])
+        self.window = []
+        self.last = (self.points[0], self.points[1])
+        self.pending = None
+        self.length = 0.0
+        self.drawn = 0
+
+    def extend(self, point):
+        '''Adds a sample and returns the segments that became final as
+        (path, length of the stroke drawn before it).'''
+        x, y = point.x(), point.y()
+        if math.hypot(x - self.last[0], y - self.last[1]) < self.min_distance:
+            self.pending = (x, y)
+            return []
+        self.pending = None
+        self.last = (x, y)
+        ax, ay = self.points[-2], self.points[-1]
+        if len(self.window) < self.WINDOW and all(
+                _segment_distance(wx, wy, ax, ay, x, y) <= self.tolerance for wx, wy in self.window):
+            self.window.append((x, y))
+            return []
+        # the window is a line no more, its end is the next vertex
+        segments = self._commit(*self.window[-1]) if self.window else []
+        self.window = [(x, y)]
+        return segments
+
+    def finish(self):
+        '''Ends the stroke at the last sample and returns the remaining segments.'''
+        ends = self.window[-1:] + ([self.pending] if self.pending else [])
+        self.window, self.pending = [], None
+        segments = []
+        for x, y in ends:
+            segments += self._commit(x, y)
+        while self.drawn < len(self.points) // 2 - 1:
+            segments.append(self._segment())
+        return segments
+
+    def _commit(self, x, y):
+        self.points.extend((x, y))
+        # segment j is known once vertex j + 2 is
+        if len(self.points) // 2 - self.drawn >= 3:
+            return [self._segment()]
+        return []
+
+    def _segment(self):
+        path = self.path(self.points, self.drawn, self.drawn + 1)
+        offset = self.length
+        self.length += path.length()
+        self.drawn += 1
+        return path, offset
+
+    def tail(self):
+        '''Path from the end of the final segments to the last sample and
+        the length of the stroke before it.'''
+        path = QtGui.QPainterPath()
+        p = self.points
+        _path_move_to(path, QtCore.QPointF(p[2 * self.drawn], p[2 * self.drawn + 1]))
+        for idx in range(2 * self.drawn + 2, len(p), 2):
+            path.lineTo(QtCore.QPointF(p[idx], p[idx + 1]))
+        for x, y in self.window + ([self.pending] if self.pending else []):
+            path.lineTo(QtCore.QPointF(x, y))
+        return path, self.length
+
+    @staticmethod
+    def controls(points, j):
+        '''Bézier points of the Catmull-Rom segment from vertex j to j + 1
+        of the flat x, y array `points`, the end vertices are doubled.'''
+        last = len(points) // 2 - 1
+        x0, y0 = points[2 * max(j - 1, 0)], points[2 * max(j - 1, 0) + 1]
+        x1, y1 = points[2 * j], points[2 * j + 1]
+        x2, y2 = points[2 * j + 2], points[2 * j + 3]
+        x3, y3 = points[2 * min(j + 2, last)], points[2 * min(j + 2, last) + 1]
+        return ((x1, y1), (x1 + (x2 - x0) / 6, y1 + (y2 - y0) / 6),
+                (x2 - (x3 - x1) / 6, y2 - (y3 - y1) / 6), (x2, y2))
+
+    @classmethod
+    def path(cls, points, start=0, end=None):
+        '''Path of the segments `start` to `end` of the vertices `points`.'''
+        end = len(points) // 2 - 1 if end is None else end
+        path = QtGui.QPainterPath()
+        for j in range(start, end):
+            p1, c1, c2, p2 = (QtCore.QPointF(x, y) for x, y in cls.controls(points, j))
+            if j == start:
+                _path_move_to(path, p1)
+            _path_cubic_to(path, c1, c2, p2)
+        return path
+
+    @classmethod
+    def replay(cls, points):
+        '''The (segment, offset) pairs the stroke with vertices `points` was drawn with.'''
+        length = 0.0
+        for j in range(len(points) // 2 - 1):
+            segment = cls.path(points, j, j + 1)
+            yield segment, length
+            length += segment.length()
+
+    def pen(self, pen, offset):
+        '''Continues the dash pattern of `pen` at `offset` along the stroke.'''
+        if pen.style() == PEN_STYLES['solidLine'] or pen.widthF() <= 0:
+            return pen
+        pen = QtGui.QPen(pen)
+        pen.setDashOffset(offset / pen.widthF())
+        return pen
+
+
+@functools.lru_cache(maxsize=4096)
+def _ink_stamp(rgb, width, alpha, phase_x, phase_y):
+    '''Anti-aliased disc of diameter `width`, colour `rgb` and opacity
+    `alpha`/InkEngine.LEVELS. Its centre is `phase`/4 px right of and below
+    the corner of pixel (size//2, size//2).'''
+    size = int(math.ceil(width)) + 3
+    image = QtGui.QImage(size, size, IMAGE_FORMATS['ARGB32_Premultiplied'])
+    image.fill(0)
+    color = QColor(rgb)
+    color.setAlphaF(alpha / InkEngine.LEVELS)
+    qp = QtGui.QPainter(image)
+    qp.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+    qp.setPen(PEN_STYLES['noPen'])
+    qp.setBrush(color)
+    qp.drawEllipse(QtCore.QPointF(size // 2 + phase_x / 4, size // 2 + phase_y / 4), width / 2, width / 2)
+    qp.end()
+    return image
+
+
+class InkEngine(object):
+    '''Pressure-sensitive freehand stroke made of round brush stamps placed
+    every SPACING of their width along the stroke. Width and opacity of the
+    pen follow the pressure within WIDTH_RANGE and OPACITY_RANGE.
+
+    Stamps are pre-rendered per colour, width bucket (0.5 px), opacity
+    level and quarter-pixel offset (in device pixels), so a tablet move
+    only blits a few small images. Overlapping stamps add up, each one gets
+    the opacity that gives the pen opacity after about 1/SPACING of them.'''
+    WIDTH_RANGE = (0.2, 1.0)
+    OPACITY_RANGE = (0.35, 1.0)
+    SPACING = 0.25
+    LEVELS = 64
+
+    def __init__(self, pen):
+        self.rgb = pen.color().rgb()
+        self.alpha = pen.color().alphaF()
+        self.width = pen.widthF()
+        self.points = array('f')
+        self.last = None
+        self.next = 0.0
+        # width bucket, stamp opacity and spacing for each pressure level
+        self.levels = [self._level(idx / self.LEVELS) for idx in range(self.LEVELS + 1)]
+        self.stamps = {}
+
+    def shape(self, pressure):
+        '''Width and opacity of the pen at `pressure` (0-1).'''
+        pressure = min(max(pressure, 0.0), 1.0)
+        lo, hi = self.WIDTH_RANGE
+        width = max(self.width * (lo + (hi - lo) * pressure), 0.5)
+        lo, hi = self.OPACITY_RANGE
+        return width, self.alpha * (lo + (hi - lo) * pressure)
+
+    def _level(self, pressure):
+        width, opacity = self.shape(pressure)
+        bucket = max(round(width * 2) / 2, 0.5)
+        spacing = max(bucket * self.SPACING, 0.5)
+        alpha = round((1 - (1 - opacity) ** (spacing / bucket)) * self.LEVELS)
+        return bucket, alpha, spacing
+
+    def _add(self, x, y, pressure):
+        # continue from the stored float32 values, so replaying the stroke
+        # from its points places exactly the same stamps
+        self.points.extend((x, y, min(max(pressure, 0.0), 1.0)))
+        self.last = tuple(self.points[-3:])
+        return self.last
+
+    def begin(self, x, y, pressure):
+        '''Starts the stroke and returns its first stamps as (x, y, pressure).'''
+        self.points = array('f')
+        self.next = 0.0
+        return [self._add(x, y, pressure)]
+
+    def extend(self, x, y, pressure):
+        '''Returns the stamps from the previous point to (x, y).'''
+        x0, y0, p0 = self.last
+        length = math.hypot(x - x0, y - y0)
+        if length == 0:
+            return []
+        x, y, pressure = self._add(x, y, pressure)
+        levels, scale = self.levels, self.LEVELS
+        stamps = []
+        t = self.next
+        while t <= length:
+            f = t / length
+            p = p0 + (pressure - p0) * f
+            stamps.append((x0 + (x - x0) * f, y0 + (y - y0) * f, p))
+            t += levels[int(p * scale + 0.5)][2]
+        self.next = t - length
+        return stamps
+
+    def margin(self):
+        return _pen_margin(self.width) + 1
+
+    def paint(self, qp, stamps):
+        '''Blends `stamps` onto the painter's device.'''
+        dpr = qp.device().devicePixelRatioF()
+        if dpr != 1:
+            # stamps are rendered and placed in device pixels
+            qp.scale(1 / dpr, 1 / dpr)
+        levels, scale, draw = self.levels, self.LEVELS, qp.drawImage
+        cache = self.stamps.setdefault(dpr, {})
+        for x, y, pressure in stamps:
+            bucket, alpha, _ = levels[int(pressure * scale + 0.5)]
+            if alpha == 0:
+                continue
+            x, y = x * dpr, y * dpr
+            ix, iy = math.floor(x), math.floor(y)
+            key = (bucket, alpha, round((x - ix) * 4), round((y - iy) * 4))
+            stamp = cache.get(key)
+            if stamp is None:
+                image = _ink_stamp(self.rgb, bucket * dpr, *key[1:])
+                stamp = cache[key] = (image, image.width() // 2)
+            draw(ix - stamp[1], iy - stamp[1], stamp[0])
+
+
+@functools.lru_cache(maxsize=8)
+def _render_chart(sourcecode, dpi_scale=1.0):
+    '''Runs chart code that defines `fig` and renders the figure to a QImage.
+    The last few charts are cached by their source code and scale, so
+    placing a chart only blits this image.
+
+    Matplotlib and NumPy are imported here, on first use of the chart tool,
+    to keep them out of the startup path.'''
+    import numpy as np
+    from matplotlib.backends.backend_qt5agg import FigureCanvas
+    from matplotlib.figure import Figure
+
+    scope = {**globals(), 'np': np, 'Figure': Figure, 'FigureCanvas': FigureCanvas}
+    exec(sourcecode, scope)
+    fig = scope['fig']
+    fig.set_dpi(fig.get_dpi() * dpi_scale)
+    canvas = FigureCanvas(fig)
+    canvas.draw()
+    renderer = canvas.get_renderer()
+    width, height = int(renderer.width), int(renderer.height)
+    image = QtGui.QImage(canvas.buffer_rgba(), width, height, IMAGE_FORMATS['ARGB32']).rgbSwapped()
+    image.setDevicePixelRatio(dpi_scale)
+    return image
+
+
+def _logical_size(image):
+    # size of a (possibly HiDPI) image in canvas pixels
+    return QSize(int(image.width() / image.devicePixelRatio()), int(image.height() / image.devicePixelRatio()))
+
+
+def _cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'screenpen')
+
+
+def _lock_file(path):
+    '''Opens and locks `path`, returns the open file (the lock lasts until it
+    is closed) or None if another process holds the lock.'''
+    fp = open(path, 'a+b')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fp.close()
+        return None
+    return fp
+
+
+_RESOURCES_FORMAT = 1
+
+
+def _parse_resources(data):
+    '''Reads resources.xml in one streaming pass. Returns the icons as
+    {name: svg} and the chart codes as [(name, label, code)].'''
+    icons, codes = {}, []
+    svg, text = None, None  # parts of the open <svg> element / <code> text
+    empty = None  # start tag of the innermost element while it has no content
+    names = []
+
+    def start(tag, attrs):
+        nonlocal svg, text, empty
+        if svg is not None:
+            empty = f'<{tag}' + ''.join(f' {k}={quoteattr(v)}' for k, v in attrs.items()) + '>'
+            svg.append(empty)
+        elif tag == 'svg' and names:
+            svg = []
+            start(tag, attrs)
+        elif tag in ('icon', 'code'):
+            if not attrs.get('name'):
+                raise Exception(f'ERROR: resources.xml: {tag} doesnt contain "name" attribute')
+            names.append((tag, attrs['name'], attrs.get('label', attrs['name'])))
+            if tag == 'code':
+                text = []
+
+    def end(tag):
+        nonlocal svg, text
+        if svg is not None:
+            if svg[-1] is empty:  # no children, write <tag/>
+                svg[-1] = empty[:-1] + '/>'
+            else:
+                svg.append(f'</{tag}>')
+            if tag == 'svg':
+                icons.setdefault(names[-1][1], ''.join(svg).replace('\n', ''))
+                svg = None
+        elif tag in ('icon', 'code') and names:
+            _, name, label = names.pop()
+            if tag == 'code':
+                codes.append((name, label, ''.join(text)))
+                text = None
+
+    def characters(chars):
+        nonlocal empty
+        if svg is not None:
+            empty = None
+            svg.append(escape(chars))
+        elif text is not None:
+            text.append(chars)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+    parser.Parse(data, True)
+    if not icons:
+        raise Exception('ERROR: there are no icons in resources.xml file')
+    if not codes:
+        raise Exception('ERROR: there are no codes in resources.xml file')
+    return icons, codes
+
+
+def _load_resources(path, bundle_dir=None):
+    '''Returns (sha1, icons, codes) of resources.xml. The parsed result is
+    also marshalled into `bundle_dir`; a later start with the same file
+    (same mtime and size, or failing that the same hash) loads the bundle
+    instead of parsing XML.'''
+    stat = os.stat(path)
+    bundle_path = bundle_dir and os.path.join(
+        bundle_dir, f'resources-{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]}.marshal')
+    bundle = None
+    if bundle_path:
+        try:
+            with open(bundle_path, 'rb') as fp:
+                bundle = marshal.load(fp)
+            if bundle['format'] != _RESOURCES_FORMAT or bundle['version'] != __version__:
+                bundle = None
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            bundle = None
+        if bundle and (bundle['mtime'], bundle['size']) == (stat.st_mtime_ns, stat.st_size):
+            return bundle['hash'], bundle['icons'], bundle['codes']
+
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if bundle and bundle['hash'] == digest:
+        icons, codes = bundle['icons'], bundle['codes']
+    else:
+        icons, codes = _parse_resources(data)
+    if bundle_path:
+        bundle = {
+            'format': _RESOURCES_FORMAT, 'version': __version__,
+            'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': digest,
+            'icons': icons, 'codes': codes,
+        }
+        try:
+            os.makedirs(bundle_dir, exist_ok=True)
+            with open(f'{bundle_path}.{os.getpid()}.tmp', 'wb') as fp:
+                marshal.dump(bundle, fp)
+            os.replace(f'{bundle_path}.{os.getpid()}.tmp', bundle_path)
+        except OSError:
+            pass
+    return digest, icons, codes
+
+
+def _render_svg(svg, size):
+    '''Rasterizes SVG data so that its longer side is `size` pixels.'''
+    buffer = QtCore.QBuffer()
+    buffer.setData(svg)
+    reader = QtGui.QImageReader(buffer, b'svg')
+    default_size = reader.size()
+    if default_size.isValid():
+        scale = size / max(default_size.width(), default_size.height())
+        reader.setScaledSize(QSize(round(default_size.width()*scale), round(default_size.height()*scale)))
+    return reader.read()
+
+
+class IconCache(object):
+    '''Rasterized icons and cursors, kept in memory and as PNG files in the
+    user cache directory. The files of a screenpen version and resources.xml
+    hash share a subdirectory, the subdirectories of other versions and
+    hashes are removed when a new one is created. The key has to cover
+    everything else that changes the pixels (name, colors, size, device
+    pixel ratio).'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.pixmaps = {}
+
+    def _subdirectory(self, resources_hash):
+        path = os.path.join(self.directory, f'{__version__}-{resources_hash[:16]}')
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(self.directory):
+                other = os.path.join(self.directory, name)
+                if other == path:
+                    continue
+                if os.path.isdir(other):
+                    shutil.rmtree(other, ignore_errors=True)
+                else:
+                    # PNGs of the flat layout of older versions
+                    try:
+                        os.remove(other)
+                    except OSError:
+                        pass
+        return path
+
+    def get(self, resources_hash, key, render):
+        '''Returns the QPixmap for `key`, `render()` makes its QImage on a miss.'''
+        pixmap = self.pixmaps.get((resources_hash, key))
+        if pixmap is not None:
+            return pixmap
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        path = os.path.join(self.directory, f'{__version__}-{resources_hash[:16]}', f'{digest}.png')
+        image = QtGui.QImage(path)
+        if image.isNull():
+            image = render()
+            try:
+                self._subdirectory(resources_hash)
+                if image.save(f'{path}.{os.getpid()}.tmp', 'PNG'):
+                    os.replace(f'{path}.{os.getpid()}.tmp', path)
+            except OSError:
+                pass
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self.pixmaps[(resources_hash, key)] = pixmap
+        return pixmap
+
+
+@functools.lru_cache(maxsize=None)
+def _writable_formats():
+    return {bytes(fmt).lower() for fmt in QtGui.QImageWriter.supportedImageFormats()}
+
+
+def _reserve_filename(directory, stem, extension):
+    '''Creates the empty file `stem.extension` in `directory`, or `stem_N.extension`
+    when that exists, and returns its path. Creating it reserves the name
+    for a save that is still running.'''
+    os.makedirs(directory, exist_ok=True)
+    n = 0
+    while True:
+        path = os.path.join(directory, f'{stem}_{n}.{extension}' if n else f'{stem}.{extension}')
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            return path
+        except FileExistsError:
+            n += 1
+
+
+def _save_vector(path, fmt, size, items, base, screenshot, board):
+    '''Writes an SVG or PDF export into the reserved file, on a worker thread.'''
+    try:
+        if fmt == 'svg':
+            export_svg(path, size, items, base, screenshot, board)
+        elif not export_pdf(path, size, items, base, screenshot, board):
+            raise OSError(f'Cannot write {path}')
+        return True
+    except OSError:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+
+def _reserve_directory(directory, stem):
+    '''Creates the directory `stem`, or `stem_N` when it exists, and returns its path.'''
+    n = 0
+    while True:
+        path = os.path.join(directory, f'{stem}_{n}' if n else stem)
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            n += 1
+
+
+def _save_image(image, path, fmt, quality):
+    '''Encodes `image` into the reserved file at `path`, runs on a worker thread.
+    For PNG a lower quality means stronger (slower) compression.'''
+    if image.save(path, fmt.upper(), quality):
+        return True
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return False
+
+
+def _pen_margin(width):
+    # half of the pen width plus the corner of a square cap (w/2 * sqrt(2))
+    return int(width * 0.75) + 2
+
+
+class Style(object):
+    '''Pen of a scene item.'''
+    __slots__ = ('color', 'width', 'pen_style', 'cap', 'join')
+
+    def __init__(self, pen):
+        self.color = pen.color().rgba()
+        self.width = pen.widthF()
+        self.pen_style = pen.style()
+        self.cap = pen.capStyle()
+        self.join = pen.joinStyle()
+
+    def pen(self):
+        pen = QtGui.QPen()
+        pen.setBrush(QtGui.QBrush(QtGui.QColor.fromRgba(self.color)))
+        pen.setStyle(self.pen_style)
+        pen.setCapStyle(self.cap)
+        pen.setJoinStyle(self.join)
+        pen.setWidthF(self.width)
+        return pen
+
+
+class SceneItem(object):
+    '''One committed annotation: its kind (the tool that drew it), style and
+    points as a flat x, y array (x, y, pressure for drawInk). Charts keep
+    their rendered image.'''
+    __slots__ = ('kind', 'style', 'points', 'image', 'bounds')
+
+    def __init__(self, kind, style=None, points=(), image=None):
+        self.kind = kind
+        self.style = style
+        self.points = array('f', points)
+        self.image = image
+        self.bounds = self._bounds()
+
+    @property
+    def nbytes(self):
+        nbytes = 128 + self.points.itemsize * len(self.points)
+        if self.image is not None:
+            nbytes += self.image.sizeInBytes()
+        return nbytes
+
+    def _bounds(self):
+        if self.kind == 'clear':
+            return None
+        if self.kind == 'drawInk':
+            xs, ys = self.points[0::3], self.points[1::3]
+            m = _pen_margin(self.style.width) + 1
+            return QtCore.QRect(
+                QtCore.QPoint(math.floor(min(xs)), math.floor(min(ys))),
+                QtCore.QPoint(math.floor(max(xs)), math.floor(max(ys)))
+            ).adjusted(-m, -m, m, m)
+        xs, ys = self.points[0::2], self.points[1::2]
+        if self.kind == 'drawChart':
+            return QtCore.QRect(QtCore.QPoint(int(xs[0]), int(ys[0])), _logical_size(self.image))
+        m = _pen_margin(self.style.width)
+        if self.kind in ['drawPath', 'drawEraser']:
+            # the spline may bulge out of the box of its vertices
+            return StrokeEngine.path(self.points).controlPointRect().toAlignedRect().adjusted(-m, -m, m, m)
+        if self.kind == 'drawDot':
+            m += 10
+        return QtCore.QRect(
+            QtCore.QPoint(int(min(xs)), int(min(ys))),
+            QtCore.QPoint(int(max(xs)), int(max(ys)))
+        ).adjusted(-m, -m, m, m)
+
+    def _point(self, idx):
+        return QtCore.QPoint(int(self.points[2*idx]), int(self.points[2*idx + 1]))
+
+    def paint(self, qp):
+        if self.kind == 'drawChart':
+            qp.drawImage(self._point(0), self.image)
+            return
+        if self.kind == 'drawInk':
+            ink = InkEngine(self.style.pen())
+            p = self.points
+            stamps = ink.begin(p[0], p[1], p[2])
+            for i in range(3, len(p), 3):
+                stamps += ink.extend(p[i], p[i + 1], p[i + 2])
+            qp.save()
+            qp.setCompositionMode(COMPOSITION_MODE['source_over'])
+            ink.paint(qp, stamps)
+            qp.restore()
+            return
+        pen = self.style.pen()
+        qp.setPen(pen)
+        qp.setBrush(BRUSHES['no_brush'])
+        if self.kind in ['drawPath', 'drawEraser']:
+            # replay the segments exactly as they were drawn live
+            stroke = StrokeEngine()
+            for segment, offset in stroke.replay(self.points):
+                qp.setPen(stroke.pen(pen, offset))
+                qp.drawPath(segment)
+        elif self.kind == 'drawRect':
+            qp.drawRect(QtCore.QRect(self._point(0), self._point(1)))
+        elif self.kind == 'drawLine':
+            qp.drawLine(self._point(0), self._point(1))
+        elif self.kind == 'drawDot':
+            qp.setBrush(pen.brush())
+            qp.drawEllipse(self._point(0), 10, 10)
+
+
+class TiledCanvas(object):
+    '''Transparent ARGB32 image split into TILE x TILE tiles. A tile is
+    allocated only when something is drawn on it, so clearing, copying and
+    compositing cost is proportional to the amount of ink, not screen area.
+    Copies share tiles until one of them is painted on (QImage is
+    implicitly shared). `version` grows with every change.
+
+    Sizes and rects are in logical pixels, the tiles are in device pixels
+    (TILE device pixels square, `dpr` device pixels per logical pixel), so
+    on HiDPI screens the drawings are as sharp as the screen.'''
+    TILE = 256
+
+    def __init__(self, size, dpr=1.0):
+        self._size = QSize(size)
+        self.dpr = dpr
+        self.tiles = {}
+        self.version = 0
+
+    def size(self):
+        return QSize(self._size)
+
+    def deviceSize(self):
+        return QSize(math.ceil(self._size.width() * self.dpr), math.ceil(self._size.height() * self.dpr))
+
+    def rect(self):
+        return QtCore.QRect(QtCore.QPoint(0, 0), self._size)
+
+    @property
+    def nbytes(self):
+        return sum(tile.sizeInBytes() for tile in self.tiles.values())
+
+    def clear(self):
+        self.tiles = {}
+        self.version += 1
+
+    def copy(self):
+        canvas = TiledCanvas(self._size, self.dpr)
+        canvas.tiles = {key: QtGui.QImage(tile) for key, tile in self.tiles.items()}
+        return canvas
+
+    def _device(self, rect):
+        '''Device pixels covered by `rect`.'''
+        if self.dpr == 1:
+            return QtCore.QRect(rect)
+        return QtCore.QRectF(
+            rect.x() * self.dpr, rect.y() * self.dpr, rect.width() * self.dpr, rect.height() * self.dpr
+        ).toAlignedRect()
+
+    def _tiles(self, rect):
+        '''Yields (key, tile rect in device pixels) of the tiles under `rect`.'''
+        rect = self._device(rect).intersected(QtCore.QRect(QtCore.QPoint(0, 0), self.deviceSize()))
+        if rect.isEmpty():
+            return
+        t = self.TILE
+        for ty in range(rect.top() // t, rect.bottom() // t + 1):
+            for tx in range(rect.left() // t, rect.right() // t + 1):
+                yield (tx, ty), QtCore.QRect(tx*t, ty*t, t, t)
+
+    def _origin(self, tile_rect):
+        return QtCore.QPointF(tile_rect.x() / self.dpr, tile_rect.y() / self.dpr)
+
+    def _painter(self, key, tile_rect, rect):
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = QtGui.QImage(tile_rect.size(), IMAGE_FORMATS['ARGB32'])
+            tile.setDevicePixelRatio(self.dpr)
+            tile.fill(COLORS['transparent'])
+            self.tiles[key] = tile
+        qp = QtGui.QPainter(tile)
+        qp.setCompositionMode(COMPOSITION_MODE['source'])
+        origin = self._origin(tile_rect)
+        qp.translate(-origin.x(), -origin.y())
+        qp.setClipRect(rect)
+        return qp
+
+    def paint(self, rect, draw):
+        '''Calls `draw(painter)` for every tile under `rect`, the painter uses
+        canvas coordinates, is clipped to `rect` and is in Source mode.'''
+        self.version += 1
+        for key, tile_rect in self._tiles(rect):
+            qp = self._painter(key, tile_rect, rect)
+            draw(qp)
+            qp.end()
+
+    def copyFrom(self, other, rect):
+        '''Replaces `rect` with the same area of `other` (None = transparent),
+        both canvases have the same size and `dpr`.'''
+        tiles = {} if other is None else other.tiles
+        device = self._device(rect)
+        bounds = QtCore.QRect(QtCore.QPoint(0, 0), self.deviceSize())
+        self.version += 1
+        for key, tile_rect in self._tiles(rect):
+            src = tiles.get(key)
+            if device.contains(tile_rect.intersected(bounds)):
+                if src is None:
+                    self.tiles.pop(key, None)
+                else:
+                    self.tiles[key] = QtGui.QImage(src)
+            elif src is not None:
+                qp = self._painter(key, tile_rect, rect)
+                qp.drawImage(self._origin(tile_rect), src)
+                qp.end()
+            elif key in self.tiles:
+                qp = self._painter(key, tile_rect, rect)
+                qp.fillRect(rect, COLORS['transparent'])
+                qp.end()
+
+    def drawOn(self, qp, rect):
+        '''Draws `rect` of the canvas with painter `qp` (in canvas coordinates).
+        On a device with the same `dpr` the tiles are copied 1:1.'''
+        device = self._device(rect)
+        for key, tile_rect in self._tiles(rect):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                part = tile_rect.intersected(device)
+                qp.drawImage(self._origin(part), tile, QtCore.QRectF(part.translated(-tile_rect.x(), -tile_rect.y())))
+
+
+class Scene(object):
+    '''Committed annotations in drawing order; undo and redo move the
+    `current` index. Once there are more than `limit` items or they take
+    more than `memory_limit` bytes, the oldest ones are baked into a
+    raster base layer and can no longer be undone.'''
+
+    def __init__(self, size, limit=500, memory_limit=256*1024*1024, dpr=1.0):
+        self.size = size
+        self.dpr = dpr
+        self.limit = limit
+        self.memory_limit = memory_limit
+        self.items = []
+        self.current = 0
+        self.nbytes = 0
+        self.base = None
+
+    @property
+    def base_nbytes(self):
+        '''Memory of the baked base layer, `nbytes` counts the items only.'''
+        return 0 if self.base is None else self.base.nbytes
+
+    def add(self, item):
+        for el in self.items[self.current:]:
+            self.nbytes -= el.nbytes
+        del self.items[self.current:]
+        self.items.append(item)
+        self.nbytes += item.nbytes
+        self.current += 1
+        while len(self.items) > 1 and (len(self.items) > self.limit or self.nbytes > self.memory_limit):
+            self._bake(self.items.pop(0))
+            self.current -= 1
+
+    def _bake(self, item):
+        self.nbytes -= item.nbytes
+        if self.base is None:
+            self.base = TiledCanvas(self.size, self.dpr)
+        if item.kind == 'clear':
+            self.base.clear()
+        else:
+            self.base.paint(item.bounds, item.paint)
+
+    def _rect(self, item):
+        return QtCore.QRect(QtCore.QPoint(0, 0), self.size) if item.bounds is None else item.bounds
+
+    def undo(self):
+        '''Returns the canvas rect to re-render or None if there is nothing to undo.'''
+        if self.current < 1:
+            return None
+        self.current -= 1
+        return self._rect(self.items[self.current])
+
+    def redo(self):
+        if self.current >= len(self.items):
+            return None
+        self.current += 1
+        return self._rect(self.items[self.current - 1])
+
+    def render(self, canvas, rect):
+        '''Rebuilds `rect` of `canvas` from the base layer and the items.'''
+        visible = self.items[:self.current]
+        start = 0
+        for idx, item in enumerate(visible):
+            if item.kind == 'clear':
+                start = idx + 1
+        canvas.copyFrom(self.base if start == 0 else None, rect)
+        for item in visible[start:]:
+            if item.bounds is not None and item.bounds.intersects(rect):
+                canvas.paint(item.bounds.intersected(rect), item.paint)
+
+
+def _enum_int(value):
+    # PyQt6 enums are enum.Enum, PyQt5 ones are ints
+    return getattr(value, 'value', value)
+
+
+# Qt.PenCapStyle and Qt.PenJoinStyle values
+_SVG_CAPS = {0x00: 'butt', 0x10: 'square', 0x20: 'round'}
+_SVG_JOINS = {0x00: 'miter', 0x40: 'bevel', 0x80: 'round', 0x100: 'miter'}
+
+
+def _export_items(scene):
+    '''Visible items of `scene` after the last clear and the baked base
+    layer if it is still visible. Items and tiles are shared, not copied.'''
+    visible = scene.items[:scene.current]
+    start = 0
+    for idx, item in enumerate(visible):
+        if item.kind == 'clear':
+            start = idx + 1
+    base = scene.base.copy() if scene.base is not None and start == 0 else None
+    return visible[start:], base
+
+
+def _base_image(base):
+    image = QtGui.QImage(base.deviceSize(), IMAGE_FORMATS['ARGB32'])
+    image.setDevicePixelRatio(base.dpr)
+    image.fill(0)
+    qp = QtGui.QPainter(image)
+    base.drawOn(qp, base.rect())
+    qp.end()
+    return image
+
+
+def _png_base64(image):
+    buffer = QtCore.QBuffer()
+    buffer.open(OPEN_MODES['writeOnly'])
+    image.save(buffer, 'PNG', 80)
+    return base64.b64encode(bytes(buffer.data())).decode('ascii')
+
+
+def _svg_image(image, rect):
+    return (f'<image x="{rect.x()}" y="{rect.y()}" width="{rect.width()}" height="{rect.height()}" '
+            f'preserveAspectRatio="none" xlink:href="data:image/png;base64,{_png_base64(image)}"/>\n')
+
+
+def _svg_points(item):
+    p = item.points
+    return f'M{p[0]:.1f} {p[1]:.1f}' + ''.join(
+        ' C' + ' '.join(f'{x:.1f} {y:.1f}' for x, y in StrokeEngine.controls(p, j)[1:])
+        for j in range(len(p) // 2 - 1))
+
+
+def _ink_image(item, dpr=2.0):
+    '''Pressure ink rendered from its stamps like on the canvas, at `dpr`
+    pixels per canvas pixel. Vector output embeds it like a chart, since
+    translucent overlapping stamps have no exact vector equivalent.'''
+    rect = item.bounds
+    image = QtGui.QImage(math.ceil(rect.width() * dpr), math.ceil(rect.height() * dpr),
+                         IMAGE_FORMATS['ARGB32_Premultiplied'])
+    image.setDevicePixelRatio(dpr)
+    image.fill(0)
+    qp = QtGui.QPainter(image)
+    qp.translate(-rect.x(), -rect.y())
+    item.paint(qp)
+    qp.end()
+    return image
+
+
+def _svg_stroke(style, color=None):
+    color = QColor.fromRgba(style.color) if color is None else color
+    width = max(style.width, 1)
+    attrs = (f'stroke="{color.name()}" stroke-opacity="{color.alphaF():.3g}" stroke-width="{width:g}" '
+             f'stroke-linecap="{_SVG_CAPS.get(_enum_int(style.cap), "square")}" '
+             f'stroke-linejoin="{_SVG_JOINS.get(_enum_int(style.join), "bevel")}"')
+    if _enum_int(style.pen_style) != _enum_int(PEN_STYLES['solidLine']):
+        dashes = style.pen().dashPattern()
+        if dashes:
+            attrs += ' stroke-dasharray="' + ' '.join(f'{d*width:g}' for d in dashes) + '"'
+    return attrs
+
+
+def _svg_item(item):
+    p = item.points
+    if item.kind == 'drawChart':
+        return _svg_image(item.image, item.bounds)
+    stroke = _svg_stroke(item.style)
+    if item.kind == 'drawPath':
+        return f'<path d="{_svg_points(item)}" fill="none" {stroke}/>\n'
+    if item.kind == 'drawInk':
+        return _svg_image(_ink_image(item), item.bounds)
+    if item.kind == 'drawRect':
+        x, y = min(p[0], p[2]), min(p[1], p[3])
+        return f'<rect x="{x:g}" y="{y:g}" width="{abs(p[2]-p[0]):g}" height="{abs(p[3]-p[1]):g}" fill="none" {stroke}/>\n'
+    if item.kind == 'drawLine':
+        return f'<line x1="{p[0]:g}" y1="{p[1]:g}" x2="{p[2]:g}" y2="{p[3]:g}" {stroke}/>\n'
+    if item.kind == 'drawDot':
+        color = QColor.fromRgba(item.style.color)
+        return f'<circle cx="{p[0]:g}" cy="{p[1]:g}" r="10" fill="{color.name()}" fill-opacity="{color.alphaF():.3g}" {stroke}/>\n'
+    return ''
+
+
+def export_svg(path, size, items, base=None, screenshot=None, board=None):
+    '''Writes the annotations as SVG, item by item, so memory does not grow
+    with the number of strokes. The `screenshot` QImage is embedded as one
+    image, the `board` QColor covers it like on screen. An eraser stroke becomes a mask over a group
+    with everything drawn before it.'''
+    erasers = [item for item in items if item.kind == 'drawEraser']
+    width, height = size.width(), size.height()
+    with open(path, 'w', encoding='utf-8') as fp:
+        fp.write(f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                 f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                 f'width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n')
+        if erasers:
+            fp.write('<defs>\n')
+            for idx, item in enumerate(erasers):
+                fp.write(f'<mask id="eraser{idx}" maskUnits="userSpaceOnUse" x="0" y="0" width="{width}" height="{height}">'
+                         f'<rect width="{width}" height="{height}" fill="white"/>'
+                         f'<path d="{_svg_points(item)}" fill="none" {_svg_stroke(item.style, QColor(0, 0, 0))}/>'
+                         f'</mask>\n')
+            fp.write('</defs>\n')
+        if screenshot is not None:
+            fp.write(_svg_image(screenshot, QtCore.QRect(0, 0, width, height)))
+        if board is not None:
+            fp.write(f'<rect width="{width}" height="{height}" fill="{board.name()}"/>\n')
+        # the last eraser masks the outermost group
+        for idx in reversed(range(len(erasers))):
+            fp.write(f'<g mask="url(#eraser{idx})">\n')
+        if base is not None:
+            fp.write(_svg_image(_base_image(base), QtCore.QRect(0, 0, width, height)))
+        for item in items:
+            fp.write('</g>\n' if item.kind == 'drawEraser' else _svg_item(item))
+        fp.write('</svg>\n')
+
+
+def _stroke_path(item):
+    return StrokeEngine.path(item.points)
+
+
+def export_pdf(path, size, items, base=None, screenshot=None, board=None):
+    '''Writes the annotations as a one page PDF with 1 pt per canvas pixel.
+    Strokes stay vector paths; an eraser stroke clips away its outline from
+    everything drawn before it.'''
+    writer = QtGui.QPdfWriter(path)
+    writer.setResolution(72)
+    writer.setPageSize(QtGui.QPageSize(QtCore.QSizeF(size), PAGE_SIZE_UNITS['point']))
+    writer.setPageMargins(QtCore.QMarginsF(0, 0, 0, 0))
+    full = QtGui.QPainterPath()
+    full.addRect(QtCore.QRectF(0, 0, size.width(), size.height()))
+
+    # items between erasers share a clip: the page minus all later erasers
+    groups, erasers = [[]], []
+    for item in items:
+        if item.kind == 'drawEraser':
+            erasers.append(item)
+            groups.append([])
+        else:
+            groups[-1].append(item)
+    clips = [None] * len(groups)
+    erased = QtGui.QPainterPath()
+    for idx in reversed(range(len(groups))):
+        clips[idx] = None if erased.isEmpty() else full.subtracted(erased)
+        if idx > 0:
+            eraser = erasers[idx - 1]
+            stroker = QtGui.QPainterPathStroker()
+            stroker.setWidth(eraser.style.width)
+            stroker.setCapStyle(eraser.style.cap)
+            stroker.setJoinStyle(eraser.style.join)
+            erased = erased.united(stroker.createStroke(_stroke_path(eraser)))
+
+    qp = QtGui.QPainter(writer)
+    page = QtCore.QRectF(0, 0, size.width(), size.height())
+    if screenshot is not None:
+        qp.drawImage(page, screenshot)
+    if board is not None:
+        qp.fillRect(page, board)
+    for idx, group in enumerate(groups):
+        if clips[idx] is not None:
+            qp.setClipPath(clips[idx])
+        else:
+            qp.setClipping(False)
+        if idx == 0 and base is not None:
+            qp.drawImage(page, _base_image(base))
+        for item in group:
+            if item.kind == 'drawPath':
+                qp.setPen(item.style.pen())
+                qp.setBrush(BRUSHES['no_brush'])
+                qp.drawPath(_stroke_path(item))
+            elif item.kind == 'drawInk':
+                qp.drawImage(QtCore.QRectF(item.bounds), _ink_image(item))
+            else:
+                item.paint(qp)
+    return qp.end()
+
+
+class SessionJournal(object):
+    '''Append-only binary log of committed scene items, undo/redo steps and
+    board changes, used by --restore to rebuild the last session.
+
+    `append` only queues the change; a background thread encodes and writes
+    the records and batches fsyncs so that there are at most 1/SYNC_INTERVAL
+    of them per second. A record is a (type, payload size) header and the
+    payload; a torn record at the end of the file is dropped when reading.
+
+    A new session moves the journal of the previous one to `path`.prev, so
+    a plain start after a crash does not lose it. Every running instance
+    uses its own journal slot, see `open`.'''
+    ITEM, UNDO, REDO, BOARD = range(1, 5)
+    KINDS = ('drawPath', 'drawEraser', 'drawRect', 'drawLine', 'drawDot', 'drawChart', 'clear', 'drawInk')
+    SYNC_INTERVAL = 0.25
+    _header = struct.Struct('<BI')      # record type, payload size
+    _item = struct.Struct('<BI')        # kind, number of point coordinates
+    _style = struct.Struct('<IfHHH')    # rgba, width, pen style, cap, join
+    _image = struct.Struct('<IIIf')     # width, height, bytes per line, device pixel ratio
+    _board = struct.Struct('<BI')       # has color, rgba
+    SLOTS = 8
+
+    def __init__(self, path, restore=False, lock=None):
+        '''Opens the journal at `path`. With `restore` the records of the
+        previous session are read into `records` and new ones are appended
+        after them, otherwise the journal starts empty. `lock` is closed
+        with the journal.'''
+        self.path = path
+        self.records = []
+        self.lock = lock
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        previous = f'{path}.prev'
+        empty = not os.path.exists(path) or os.path.getsize(path) == 0
+        if restore:
+            # a plain start after the crash has already moved the session aside
+            if empty and os.path.exists(previous):
+                os.replace(previous, path)
+        elif not empty:
+            os.replace(path, previous)
+        self.file = open(path, 'a+b' if restore else 'wb')
+        if restore:
+            self.file.seek(0)
+            self.records, valid = self.read(self.file.read())
+            self.file.truncate(valid)
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name='screenpen-journal', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, kind, value=None):
+        '''Queues a record: a SceneItem for ITEM, the board QColor or None
+        (transparent) for BOARD and nothing for UNDO and REDO.'''
+        if self.thread is not None:
+            self.queue.put((kind, value))
+
+    def close(self):
+        '''Writes the queued records and stops the writer thread.'''
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.file.close()
+            if self.lock is not None:
+                self.lock.close()
+
+    @classmethod
+    def open(cls, directory, restore=False):
+        '''Opens the journal in `directory` that no other running screenpen
+        holds: session.journal, session-2.journal, ... up to SLOTS.'''
+        os.makedirs(directory, exist_ok=True)
+        for slot in range(1, cls.SLOTS + 1):
+            path = os.path.join(directory, 'session.journal' if slot == 1 else f'session-{slot}.journal')
+            lock = _lock_file(f'{path}.lock')
+            if lock is None:
+                continue
+            try:
+                return cls(path, restore, lock)
+            except OSError:
+                lock.close()
+                raise
+        raise OSError(f'all {cls.SLOTS} session journals are in use')
+
+    def _run(self):
+        synced = 0
+        while True:
+            batch = [self.queue.get()]
+            # collect what arrives until the next fsync is due
+            deadline = synced + self.SYNC_INTERVAL
+            while batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.file.write(b''.join(self._encode(*record) for record in batch if record is not None))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as ex:
+                print(f'WARNING: Cannot write the session journal: {ex}')
+            synced = time.monotonic()
+            if batch[-1] is None:
+                return
+
+    def _encode(self, kind, value):
+        if kind == self.ITEM:
+            payload = self._encodeItem(value)
+        elif kind == self.BOARD:
+            payload = self._board.pack(value is not None, 0 if value is None else value.rgba())
+        else:
+            payload = b''
+        return self._header.pack(kind, len(payload)) + payload
+
+    def _encodeItem(self, item):
+        parts = [self._item.pack(self.KINDS.index(item.kind), len(item.points))]
+        if item.style is not None:
+            style = item.style
+            parts.append(self._style.pack(
+                style.color, style.width,
+                _enum_int(style.pen_style), _enum_int(style.cap), _enum_int(style.join)
+            ))
+        parts.append(item.points.tobytes())
+        if item.image is not None:
+            image = item.image.convertToFormat(IMAGE_FORMATS['ARGB32'])
+            bits = image.constBits()
+            bits.setsize(image.height() * image.bytesPerLine())
+            parts.append(self._image.pack(image.width(), image.height(), image.bytesPerLine(), image.devicePixelRatio()))
+            parts.append(zlib.compress(bytes(bits), 1))
+        return b''.join(parts)
+
+    @classmethod
+    def read(cls, data):
+        '''Decodes journal data into [(type, value)]. Returns the records and
+        the length of the valid part of `data`.'''
+        records, pos = [], 0
+        while pos + cls._header.size <= len(data):
+            kind, size = cls._header.unpack_from(data, pos)
+            payload = data[pos + cls._header.size:pos + cls._header.size + size]
+            if len(payload) < size:
+                break
+            try:
+                if kind == cls.ITEM:
+                    value = cls._decodeItem(payload)
+                elif kind == cls.BOARD:
+                    has_color, rgba = cls._board.unpack(payload)
+                    value = QColor.fromRgba(rgba) if has_color else None
+                elif kind in (cls.UNDO, cls.REDO):
+                    value = None
+                else:
+                    break
+            except (struct.error, IndexError, ValueError, zlib.error):
+                break
+            records.append((kind, value))
+            pos += cls._header.size + size
+        return records, pos
+
+    @classmethod
+    def _decodeItem(cls, payload):
+        kind_idx, count = cls._item.unpack_from(payload)
+        kind = cls.KINDS[kind_idx]
+        pos = cls._item.size
+        style = None
+        if kind not in ('drawChart', 'clear'):
+            color, width, pen_style, cap, join = cls._style.unpack_from(payload, pos)
+            pos += cls._style.size
+            pen = QtGui.QPen()
+            pen.setBrush(QtGui.QBrush(QColor.fromRgba(color)))
+            pen.setStyle(QtCore.Qt.PenStyle(pen_style))
+            pen.setCapStyle(QtCore.Qt.PenCapStyle(cap))
+            pen.setJoinStyle(QtCore.Qt.PenJoinStyle(join))
+            pen.setWidthF(width)
+            style = Style(pen)
+        points = array('f')
+        points.frombytes(payload[pos:pos + 4*count])
+        if len(points) != count:
+            raise ValueError('truncated points')
+        pos += 4*count
+        image = None
+        if kind == 'drawChart':
+            width, height, stride, dpr = cls._image.unpack_from(payload, pos)
+            pixels = zlib.decompress(payload[pos + cls._image.size:])
+            image = QtGui.QImage(pixels, width, height, stride, IMAGE_FORMATS['ARGB32']).copy()
+            image.setDevicePixelRatio(dpr)
+        return SceneItem(kind, style, points, image)
+
+
+class ScreenRecorder(object):
+    '''Records the composited canvas as a PNG sequence. A QTimer samples it
+    `fps` times per second and skips frames where nothing changed. Frames
+    are painted straight into a small ring of shared memory blocks and
+    encoded by a process pool (screenpen.recording), so the GUI thread only
+    composes. When every block is still being encoded the frame is dropped.
+    frames.ffconcat next to the frames keeps their timing for ffmpeg.'''
+    def __init__(self, window, directory, fps=10, workers=2):
+        self.window = window
+        self.directory = directory
+        self.fps = fps
+        self.workers = workers
+        self.timer = QtCore.QTimer(window)
+        self.timer.setTimerType(TIMER_TYPES['precise'])
+        self.timer.timeout.connect(self._tick)
+        self.pool = None
+
+    @property
+    def active(self):
+        return self.pool is not None
+
+    def start(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context, shared_memory
+        from screenpen.recording import lower_priority, warm_up
+        self.path = _reserve_directory(self.directory, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        size = self.window.imageDraw.deviceSize()
+        self.width, self.height = size.width(), size.height()
+        self.stride = 4 * self.width
+        self.lock = threading.Lock()
+        self.blocks = []
+        try:
+            for _ in range(2 * self.workers):
+                shm = shared_memory.SharedMemory(create=True, size=self.stride * self.height)
+                self.blocks.append(shm)
+                # touch the pages now, not on the first frame painted into them
+                ctypes.memset(ctypes.addressof(ctypes.c_char.from_buffer(shm.buf)), 0, shm.size)
+            self.free = list(self.blocks)
+            # spawn, forking a process with Qt threads is not safe
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'), initializer=lower_priority)
+            # start the workers now rather than while drawing
+            for future in [self.pool.submit(warm_up) for _ in range(self.workers)]:
+                future.result()
+        except Exception:
+            self._release()
+            try:
+                os.rmdir(self.path)
+            except OSError:
+                pass
+            raise
+        self.frames = []
+        self.key = None
+        self.stats = dict(frames=0, unchanged=0, dropped=0, failed=0, max_queue=0)
+        self.started = time.monotonic()
+        self.timer.start(max(1, round(1000 / self.fps)))
+        self._tick()
+
+    def _tick(self):
+        from concurrent.futures.process import BrokenProcessPool
+        from screenpen.recording import encode_frame
+        key = self.window._frameKey()
+        if key == self.key:
+            self.stats['unchanged'] += 1
+            return
+        with self.lock:
+            shm = self.free.pop() if self.free else None
+            queued = len(self.blocks) - len(self.free)
+        if shm is None:
+            self.stats['dropped'] += 1
+            return
+        self.key = key
+        self.stats['max_queue'] = max(self.stats['max_queue'], queued)
+        # paint into the shared memory without an intermediate copy
+        address = ctypes.addressof(ctypes.c_char.from_buffer(shm.buf))
+        image = QtGui.QImage(sip.voidptr(address), self.width, self.height, self.stride, IMAGE_FORMATS['ARGB32'])
+        image.setDevicePixelRatio(self.window.imageDraw.dpr)
+        self.window._composeFrame(image)
+        del image
+        path = os.path.join(self.path, f'frame_{self.stats["frames"]:06d}.png')
+        at = time.monotonic() - self.started
+        try:
+            future = self.pool.submit(encode_frame, shm.name, self.width, self.height, self.stride, path)
+        except BrokenProcessPool as ex:
+            print(f'ERROR: Recording stopped, the encoder processes failed: {ex}')
+            self.timer.stop()
+            with self.lock:
+                self.free.append(shm)
+            return
+        self.stats['frames'] += 1
+        future.add_done_callback(lambda future, shm=shm: self._encoded(shm, future, os.path.basename(path), at))
+
+    def _encoded(self, shm, future, name, at):
+        # runs on a pool thread, only written frames go to frames.ffconcat
+        with self.lock:
+            if future.exception() is not None:
+                self.stats['failed'] += 1
+            else:
+                self.frames.append((name, at))
+            self.free.append(shm)
+
+    def _release(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = self.free = []
+
+    def stop(self):
+        '''Finishes the encoding and returns the counters.'''
+        self.timer.stop()
+        self._release()
+        # frames finish encoding out of order
+        self.frames.sort(key=lambda frame: frame[1])
+        end = time.monotonic() - self.started
+        with open(os.path.join(self.path, 'frames.ffconcat'), 'w') as fp:
+            fp.write('ffconcat version 1.0\n')
+            for idx, (name, at) in enumerate(self.frames):
+                until = self.frames[idx + 1][1] if idx + 1 < len(self.frames) else end
+                fp.write(f"file '{name}'\nduration {until - at:.3f}\n")
+        return self.stats
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))] if samples else 0.0
+
+
+class FrameTimings(object):
+    '''Rolling window of paintEvent durations and of latencies from a mouse
+    move while drawing to the end of the paint that shows it, in seconds.'''
+    SAMPLES = 1000
+    # upper edges of the histogram bins in ms, the last bin takes the rest
+    BINS_MS = (1, 2, 4, 8, 16, 33)
+
+    def __init__(self, samples=SAMPLES):
+        self.paint = deque(maxlen=samples)
+        self.latency = deque(maxlen=samples)
+        self.pending = None
+
+    def moved(self):
+        # the oldest move not painted yet, later ones wait less
+        if self.pending is None:
+            self.pending = time.perf_counter()
+
+    def painted(self, start, end):
+        self.paint.append(end - start)
+        if self.pending is not None:
+            self.latency.append(end - self.pending)
+            self.pending = None
+
+    @classmethod
+    def histogram(cls, samples):
+        counts = [0] * (len(cls.BINS_MS) + 1)
+        for sample in samples:
+            ms = sample * 1000
+            counts[next((idx for idx, edge in enumerate(cls.BINS_MS) if ms < edge), len(cls.BINS_MS))] += 1
+        return counts
+
+    def summary(self):
+        return {
+            f'{name}_{label}_ms': _percentile(samples, q) * 1000
+            for name, samples in (('paint', self.paint), ('latency', self.latency))
+            for label, q in (('p50', 50), ('p99', 99))
+        }
+
+    def asdict(self):
+        return {
+            **self.summary(),
+            'paint_ms': [sample * 1000 for sample in self.paint],
+            'latency_ms': [sample * 1000 for sample in self.latency],
+        }
+
+
+class FrameHud(QtWidgets.QWidget):
+    '''Overlay with the frame timings and the history size of `owner`. The
+    window collects samples only while the HUD is shown. It is opaque, so
+    refreshing it does not repaint the canvas below and skew the samples.'''
+    SIZE = QSize(380, 190)
+    PAINT_COLOR = QColor(90, 170, 250)
+    LATENCY_COLOR = QColor(250, 170, 60)
+
+    def __init__(self, owner, timings):
+        super().__init__(owner)
+        self.owner = owner
+        self.timings = timings
+        self.setAttribute(WINDOW_ATTRS['opaquePaintEvent'])
+        self.setAttribute(WINDOW_ATTRS['transparentForMouseEvents'])
+        self.resize(self.SIZE)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.update)
+
+    def showEvent(self, event):
+        self.move(self.owner.width() - self.width() - 20, self.owner.height() - self.height() - 20)
+        self.timer.start(250)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+
+    def paintEvent(self, event):
+        timings, scene = self.timings, self.owner.scene
+        stats = timings.summary()
+        qp = QtGui.QPainter(self)
+        qp.fillRect(self.rect(), QColor(25, 25, 25))
+        line = qp.fontMetrics().height()
+        lines = [
+            (self.PAINT_COLOR, f'paint: p50 {stats["paint_p50_ms"]:.2f} ms, p99 {stats["paint_p99_ms"]:.2f} ms'),
+            (self.LATENCY_COLOR, f'move→paint: p50 {stats["latency_p50_ms"]:.2f} ms, p99 {stats["latency_p99_ms"]:.2f} ms'),
+            (QColor(COLORS['white']), f'history: {len(scene.items)} items {scene.nbytes / 2**20:.1f} MB, '
+                                      f'baked {scene.base_nbytes / 2**20:.1f} MB'),
+        ]
+        y = 8 + line
+        for color, text in lines:
+            qp.setPen(color)
+            qp.drawText(8, y, text)
+            y += line
+        # rolling histograms, a pair of bars per bin
+        bins = len(FrameTimings.BINS_MS) + 1
+        histograms = [(self.PAINT_COLOR, timings.histogram(timings.paint)),
+                      (self.LATENCY_COLOR, timings.histogram(timings.latency))]
+        peak = max(max(counts) for _, counts in histograms) or 1
+        top, bottom = y, self.height() - 8 - line
+        slot = (self.width() - 16) / bins
+        for idx in range(bins):
+            x = 8 + idx * slot
+            for offset, (color, counts) in enumerate(histograms):
+                height = (bottom - top) * counts[idx] / peak
+                qp.fillRect(QtCore.QRectF(x + 2 + offset * (slot - 4) / 2, bottom - height, (slot - 4) / 2, height), color)
+            edges = FrameTimings.BINS_MS
+            label = f'<{edges[idx]}' if idx < len(edges) else f'{edges[-1]}+'
+            qp.setPen(QColor(COLORS['white']))
+            qp.drawText(QtCore.QRectF(x, bottom, slot, line), ALIGNMENT['center'], label)
+        qp.end()
+
 
 class ScreenPenWindow(QMainWindow):
+    # path and success of a finished save, emitted from the save worker
+    imageSaved = QtCore.pyqtSignal(str, bool)
+
     def __init__(self, screen, screen_geom, pixmap: QtGui.QPixmap = None, transparent_background = True,
-                    config_file=None): # app: QApplication
+                    config_file=None, journal=None): # app: QApplication
         super().__init__()
 
         # PATHS
@@ -404,6 +1955,14 @@ class ScreenPenWindow(QMainWindow):
         boardbar_area   = TOOLBAR_AREAS[config['screenpen'].get('boardbar_area')]
         actionbar_area  = TOOLBAR_AREAS[config['screenpen'].get('actionbar_area')]
         drawing_history = config['screenpen'].getint('drawing_history')
+        history_memory_mb = config['screenpen'].getint('history_memory_mb', 256)
+        save_directory  = config['screenpen'].get('save_directory', '')
+        save_format     = config['screenpen'].get('save_format', 'png').lower()
+        save_quality    = config['screenpen'].getint('save_quality', 80)
+        record_directory = config['screenpen'].get('record_directory', '')
+        record_fps      = config['screenpen'].getfloat('record_fps', 10)
+        stroke_min_distance = config['screenpen'].getfloat('stroke_min_distance', 2)
+        stroke_tolerance = config['screenpen'].getfloat('stroke_tolerance', 1.0)
 
         exit_mouse_button = config['screenpen'].get('exit_mouse_button', '')
         exit_shortcut = config['screenpen'].get('exit_shortcut', '')
@@ -417,6 +1976,9 @@ class ScreenPenWindow(QMainWindow):
         self.files = SimpleNamespace(
             resources_xml = resources_xml_path
         )
+        self.on_first_paint = None
+        self.journal = None
+        self.icon_cache = IconCache(os.path.join(_cache_dir(), 'icons'))
         
         self.screen = screen
         self.screen_pixmap = pixmap
@@ -427,6 +1989,17 @@ class ScreenPenWindow(QMainWindow):
         self.penbar_area = penbar_area
         self.boardbar_area = boardbar_area
         self.actionbar_area = actionbar_area
+        self.save_directory = os.path.expanduser(save_directory)
+        self.save_format = save_format
+        self.save_quality = save_quality
+        self._save_pool = None
+        self.record_directory = os.path.expanduser(record_directory)
+        self.record_fps = record_fps
+        self.recorder = None
+        self.hud = None
+        self.timings = None
+        self.imageDraw = None
+        self.imageSaved.connect(self._imageSaved)
 
         if self.transparent_background:
             self.setAttribute(WINDOW_ATTRS['translucentBackground'])
@@ -437,12 +2010,24 @@ class ScreenPenWindow(QMainWindow):
         self._createCanvas()
         self._clearCanvas()
         
-        self.history = self.drawingHistory(drawing_history)
-        self.history.append(self.screen_pixmap)
+        self.scene = Scene(self.imageDraw.size(), drawing_history, history_memory_mb*1024*1024, self.imageDraw.dpr)
 
         self.begin = QtCore.QPoint()
         self.end = QtCore.QPoint()
         self.lastPoint = QtCore.QPoint()
+        self._chart_size = None
+        self._chart_image = None
+        self.curr_args = None
+        self.stroke = StrokeEngine(stroke_min_distance, stroke_tolerance)
+        self._tail_rect = None
+        # grows whenever the window-only preview of the current tool changes
+        self.preview_version = 0
+        self.ink = None
+        # mouse and tablet moves are buffered and drained once per display frame
+        self.pending_points = []
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setTimerType(TIMER_TYPES['precise'])
+        self.frame_timer.timeout.connect(self._frameTick)
 
         self.drawing = False
         self.curr_method = 'drawPath'
@@ -454,8 +2039,7 @@ class ScreenPenWindow(QMainWindow):
         self.curr_br = QtGui.QBrush(self.curr_color)
         self.curr_pen = QtGui.QPen()
         self._setupTools()
-        self._setupIcons()
-        self._setupCodes()
+        self._setupResources()
         self._createToolBars()
         if self.hidden_menus:
             self.hide_menus()
@@ -466,6 +2050,16 @@ class ScreenPenWindow(QMainWindow):
         self.sc_redo.activated.connect(self.redo)
         self.sc_toggle_menus = QShortcut(QKeySequence(config['screenpen'].get('sc_toggle_menus', 'Ctrl+1')), self)
         self.sc_toggle_menus.activated.connect(self.toggle_menus)
+        self.sc_toggle_hud = QShortcut(QKeySequence(config['screenpen'].get('sc_toggle_hud', 'Ctrl+2')), self)
+        self.sc_toggle_hud.activated.connect(self.toggleHud)
+        self.sc_dump_timings = QShortcut(QKeySequence(config['screenpen'].get('sc_dump_timings', 'Ctrl+3')), self)
+        self.sc_dump_timings.activated.connect(self.dumpTimings)
+        self.sc_record = QShortcut(QKeySequence(config['screenpen'].get('sc_record', 'Ctrl+R')), self)
+        self.sc_record.activated.connect(self.toggleRecording)
+
+        if journal is not None:
+            self._replay(journal.records)
+            self.journal = journal
 
     def _setCursor(self, cursor, hotx = None, hoty = None):
         if hotx is None:
@@ -473,8 +2067,7 @@ class ScreenPenWindow(QMainWindow):
         if hoty is None:
             hoty = 2
         if type(cursor) == str:
-            pixm = QtGui.QPixmap.fromImage(QtGui.QImage.fromData(bytes(self._applySvgConfig(self._icons[cursor], None), encoding='utf-8')))
-            pixm = pixm.scaled(QSize(32, 32))
+            pixm = self._getIconPixmap(cursor, None, 32)
             self.setCursor(QCursor(pixm, int(hotx), int(hoty)))
         elif type(cursor) == Qt.CursorShape:
             self.setCursor(QCursor(cursor))
@@ -495,40 +2088,20 @@ class ScreenPenWindow(QMainWindow):
         if (k==KEYS['shift']):
             self._setCursor(Qt.ArrowCursor)
 
-    def _setupIcons(self):
-        self._icons = {}
-        try:
-            DOMTree = minidom.parse(self.files.resources_xml)
-            icons = DOMTree.getElementsByTagName('icon')
-            if len(icons) < 1:
-                raise Exception('ERROR: there are no icons in resources.xml file')
-            for icon in icons:
-                if icon.getAttribute('name')=='':
-                    raise Exception('ERROR: resources.xml: icon doesnt contain "name" attribute')
-                self._icons[icon.getAttribute('name')] = icon.getElementsByTagName('svg')[0].toxml().replace('\n', '')
-        except FileNotFoundError as ex:
-            print('ERROR: There is no resources.xml file')
-            raise ex
-
     class Code(object): pass
-    def _setupCodes(self):
-        self._codes = []
+    def _setupResources(self):
         try:
-            DOMTree = minidom.parse(self.files.resources_xml)
-            codes = DOMTree.getElementsByTagName('code')
-            if len(codes) < 1:
-                raise Exception('ERROR: there are no codes in resources.xml file')
-            for code in codes:
-                if code.getAttribute('name')=='':
-                    raise Exception('ERROR: resources.xml: code doesnt contain "name" attribute')
-                codeobj = self.Code()
-                codeobj.name = code.getAttribute('name')
-                codeobj.label = code.getAttribute('name')
-                codeobj.code = code.firstChild.data
-                self._codes += [codeobj]
+            self._resources_hash, self._icons, codes = _load_resources(self.files.resources_xml, _cache_dir())
         except FileNotFoundError as ex:
             print('ERROR: There is no resources.xml file')
             raise ex
+        self._codes = []
+        for name, label, code in codes:
+            codeobj = self.Code()
+            codeobj.name = name
+            codeobj.label = name
+            codeobj.code = code
+            self._codes += [codeobj]
 
 
     def _applySvgConfig(self, svg_str, custom_colors_dict=None):
@@ -543,40 +2116,50 @@ class ScreenPenWindow(QMainWindow):
             parsed = parsed.replace(f'{{{el}}}', colors_dict[el])
         return parsed
 
+    def _getIconPixmap(self, name, custom_colors_dict, size):
+        dpr = self.devicePixelRatioF()
+        colors = tuple(sorted((custom_colors_dict or {}).items()))
+        def _render():
+            svg = bytes(self._applySvgConfig(self._icons[name], custom_colors_dict), encoding='utf-8')
+            return _render_svg(svg, int(size * dpr))
+        pixmap = self.icon_cache.get(self._resources_hash, (name, colors, size, dpr), _render)
+        pixmap.setDevicePixelRatio(dpr)
+        return pixmap
+
     def _getIcon(self, name, custom_colors_dict=None):
-        return QIcon(QtGui.QPixmap.fromImage(QtGui.QImage.fromData(bytes(self._applySvgConfig(self._icons[name], custom_colors_dict), encoding='utf-8'))))
+        return QIcon(self._getIconPixmap(name, custom_colors_dict, self.icon_size))
 
     def _createCanvas(self):
-        self.background = QtGui.QImage(self.size(), IMAGE_FORMATS['ARGB32'])
-        self.imageDraw = QtGui.QImage(self.size(), IMAGE_FORMATS['ARGB32'])
-        self.imageDraw_bck = QtGui.QImage(self.size(), IMAGE_FORMATS['ARGB32'])
+        # device pixel sized tiles, drawn 1:1 onto the window
+        self.imageDraw = TiledCanvas(self.size(), self.devicePixelRatioF())
+        self._updateMapping()
         self._clearBackground()
         
     def _clearBackground(self): # make background transparent
+        # background is None (transparent), the screenshot or a board color
         if self.transparent_background:
-            self.background.fill(COLORS['transparent'])
+            self.background = None
         else:
-            qp2 = QtGui.QPainter(self.background)
-            qp2.drawPixmap(self.background.rect(), self.screen_pixmap, self.screen_pixmap.rect())
-            qp2.end()
+            self.background = self.screen_pixmap
+        self._journal(SessionJournal.BOARD)
         self.update()
 
+    def _paintBackground(self, qp, rect):
+        if self.background is None:
+            return
+        if isinstance(self.background, QPixmap):
+            x_scale = self.background.width() / self.imageDraw.size().width()
+            y_scale = self.background.height() / self.imageDraw.size().height()
+            qp.drawPixmap(QtCore.QRectF(rect), self.background, QtCore.QRectF(
+                rect.x()*x_scale, rect.y()*y_scale, rect.width()*x_scale, rect.height()*y_scale
+            ))
+        else:
+            qp.fillRect(rect, self.background)
+
     def _clearCanvas(self):
-        self.imageDraw.fill(COLORS['transparent'])
-        self.imageDraw_bck.fill(COLORS['transparent'])
+        self.imageDraw.clear()
         self.update()
 
-    def drawMatplotlib(self, qp:QtGui.QPainter, canvas:FigureCanvas, p1:QtCore.QPoint):
-        size = canvas.size()
-        width, height = size.width(), size.height()
-        im = QtGui.QImage(canvas.buffer_rgba(), width, height, IMAGE_FORMATS['ARGB32']).rgbSwapped()
-        p2 = QtCore.QPoint(int(p1.x()+width), int(p1.y()+height))
-        qp.drawImage(QtCore.QRect(
-            p1, 
-            p2
-        ), im, im.rect())
-        
-
     def _setupTools(self):
         self.curr_br.setColor(self.curr_color)
         self.curr_pen.setStyle(self.curr_style)
@@ -591,7 +2174,9 @@ class ScreenPenWindow(QMainWindow):
             self._setupTools()
         return _setColor
 
-    def _getEraserPen(self, color=COLORS['transparent'], size=30):
+    def _getEraserPen(self, color=None, size=30):
+        if color is None:
+            color = COLORS['transparent']
         pen = QtGui.QPen()
         pen.setBrush(QtGui.QBrush(color))
         pen.setStyle(PEN_STYLES['solidLine']) ; pen.setCapStyle(PEN_STYLES['roundCap']) 
@@ -599,8 +2184,7 @@ class ScreenPenWindow(QMainWindow):
         return pen
 
     def setEraser(self):
-        def _setEraser():
-            pix = QPixmap()
+        def _renderCursor():
             img = QtGui.QImage(QSize(32, 32), IMAGE_FORMATS['ARGB32'])
             img.fill(COLORS['transparent'])
             qp = QtGui.QPainter(img)
@@ -615,7 +2199,9 @@ class ScreenPenWindow(QMainWindow):
             _path_cubic_to(path, QPoint(16, 17), QPoint(16, 16), QPoint(16, 16))
             qp.drawPath(path)
             qp.end()
-            pix = pix.fromImage(img)
+            return img
+        def _setEraser():
+            pix = self.icon_cache.get(self._resources_hash, ('eraser_cursor', 32), _renderCursor)
             self.setAction('drawEraser')()
             self._setCursor(pix, 16, 16)
             self._setupTools()
@@ -642,21 +2228,14 @@ class ScreenPenWindow(QMainWindow):
 
     class ChartDialog(QDialog):
         def ok_success(self, *args):
-            sourcecode = '\n'.join(list(map(lambda x: f'    {x}', self.code.toPlainText().replace('\t', '').replace(' ', '').splitlines())))
-            self.code = f'''
-def drawChart(qp:QtGui.QPainter, p1:QtCore.QPoint):
-{sourcecode}
-    canvas = FigureCanvas(fig)
-    canvas.draw()
-    canvas.setStyleSheet("background-color:transparent;")
-
-    renderer = canvas.get_renderer()
-    fwidth, fheight = fig.get_size_inches()
-    fig_bbox = fig.get_window_extent(renderer)
-    self.drawMatplotlib(qp, canvas, p1)
-setattr(self, 'drawChart', drawChart)
-'''
-            exec(self.code, {'self': self.parent, **globals()})
+            sourcecode = textwrap.dedent(self.code.toPlainText())
+            try:
+                self.parent._chart_image = _render_chart(sourcecode, self.parent.devicePixelRatioF())
+            except Exception as ex:
+                msgBox = QtWidgets.QMessageBox()
+                msgBox.setText(str(ex))
+                msgBox.exec()
+                return
             self.accept()
 
         def __init__(self, parent):
@@ -674,7 +2253,7 @@ setattr(self, 'drawChart', drawChart)
             
             self.resize(800, 600)
             self.code    = QPlainTextEdit()
-            highlight = syntax.PythonHighlighter(self.code.document())
+            highlight = _load_syntax().PythonHighlighter(self.code.document())
             self.code.zoomIn(4)
             self.code.setPlainText('')
 
@@ -707,6 +2286,7 @@ setattr(self, 'drawChart', drawChart)
             dlg = self.ChartDialog(self)
             if _execute_dialog(dlg):
                 self.curr_method = 'drawChart'
+                self._chart_size = _logical_size(self._chart_image)
             else:
                 pass
         
@@ -714,29 +2294,139 @@ setattr(self, 'drawChart', drawChart)
 
     def removeDrawing(self):
         def _removeDrawing():
+            item = SceneItem('clear')
+            self.scene.add(item)
+            self._journal(SessionJournal.ITEM, item)
             self._clearCanvas()
         return _removeDrawing
 
     def captureScreen(self):
-        for tb in self.toolBars:
-            tb.hide()
-        img = self.imageDraw.copy()
+        img = QtGui.QImage(self.imageDraw.deviceSize(), IMAGE_FORMATS['ARGB32'])
+        img.setDevicePixelRatio(self.imageDraw.dpr)
+        self._composeFrame(img)
+        return img
+
+    def _composeFrame(self, img):
+        '''Paints the screenshot, board and drawings into `img`.'''
+        img.fill(COLORS['transparent'])
+        rect = self.imageDraw.rect()
         qp = QtGui.QPainter(img)
-        qp.drawPixmap(img.rect(), self.screen_pixmap, self.screen_pixmap.rect())
-        qp.drawImage(img.rect(), self.background, self.background.rect())
-        qp.drawImage(img.rect(), self.imageDraw, self.imageDraw.rect())
+        self._paintUnderlay(qp, rect)
+        self.imageDraw.drawOn(qp, rect)
+        self._paintPreview(qp, rect, self._paintUnderlay)
         qp.end()
-        for tb in self.toolBars:
-            tb.show()
-        return img
+
+    def _paintUnderlay(self, qp, rect):
+        # unless the board is transparent or a color, it is the screenshot itself
+        if self.screen_pixmap is not None and self.background is not self.screen_pixmap:
+            qp.drawPixmap(rect, self.screen_pixmap, self.screen_pixmap.rect())
+        self._paintBackground(qp, rect)
+
+    def _frameKey(self):
+        # changes whenever _composeFrame would paint something else
+        background = self.background.rgba() if isinstance(self.background, QColor) else id(self.background)
+        return id(self.imageDraw), self.imageDraw.version, background, self.drawing and self.preview_version
+
+    def toggleRecording(self):
+        if self.recorder is None:
+            self.recorder = ScreenRecorder(self, self.record_directory or self.save_directory or os.getcwd(), self.record_fps)
+        if self.recorder.active:
+            stats = self.recorder.stop()
+            print(f'Recording saved to {self.recorder.path}: {stats["frames"]} frames, '
+                  f'{stats["unchanged"]} unchanged skipped, {stats["dropped"]} dropped, '
+                  f'{stats["failed"]} failed, max queue depth {stats["max_queue"]}')
+            self._notify(f'Recording saved to {self.recorder.path}')
+        else:
+            try:
+                self.recorder.start()
+            except (OSError, ImportError, RuntimeError) as ex:
+                # ImportError: shared memory needs Python 3.8, RuntimeError: the encoder processes failed
+                print(f'ERROR: Cannot start recording: {ex}')
+                self._notify(f'Cannot start recording: {getattr(ex, "strerror", None) or ex}')
+                return
+            print(f'Recording to {self.recorder.path}')
+
+    def toggleHud(self):
+        if self.hud is None:
+            self.hud = FrameHud(self, FrameTimings())
+        if self.hud.isVisible():
+            self.hud.hide()
+            self.timings = None
+        else:
+            self.hud.show()
+            self.hud.raise_()
+            self.timings = self.hud.timings
+
+    def dumpTimings(self):
+        '''Writes the samples collected by the HUD to a JSON file.'''
+        if self.hud is None or not self.hud.timings.paint:
+            self._notify(f'No frame timings, show them with {self.sc_toggle_hud.key().toString()} first')
+            return
+        try:
+            path = _reserve_filename(self.save_directory or os.getcwd(),
+                                     datetime.now().strftime("timings_%Y%m%d_%H%M%S"), 'json')
+            with open(path, 'w') as fp:
+                json.dump({
+                    'version': __version__,
+                    'canvas': [self.imageDraw.size().width(), self.imageDraw.size().height()],
+                    'history_items': len(self.scene.items),
+                    'history_bytes': self.scene.nbytes,
+                    'history_base_bytes': self.scene.base_nbytes,
+                    **self.hud.timings.asdict(),
+                }, fp, indent=1)
+        except OSError as ex:
+            print(f'ERROR: Cannot save the frame timings: {ex}')
+            self._notify(f'Cannot save the frame timings: {ex.strerror}')
+            return
+        print(f'Frame timings saved to {path}')
+        self._notify(f'Frame timings saved to {path}')
 
     def saveDrawing(self):
         def _saveDrawing(n=0):
-            filename = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
-            print(f'Saving {filename}')
-            self.captureScreen().save(f'{filename}')
+            # composing the image is cheap, encoding it runs on a worker thread
+            if self._save_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._save_pool = ThreadPoolExecutor(max_workers=2)
+                if self.save_format not in ('svg', 'pdf') and self.save_format.encode() not in _writable_formats():
+                    print(f'WARNING: Saving as {self.save_format} is not supported, using png')
+                    self.save_format = 'png'
+            try:
+                path = _reserve_filename(
+                    self.save_directory or os.getcwd(), datetime.now().strftime("%Y%m%d_%H%M%S"), self.save_format)
+            except OSError as ex:
+                print(f'ERROR: Cannot save the drawing: {ex}')
+                self._notify(f'Cannot save the drawing: {ex.strerror}')
+                return
+            print(f'Saving {path}')
+            if self.save_format in ('svg', 'pdf'):
+                items, base = _export_items(self.scene)
+                screenshot = None if self.screen_pixmap is None else self.screen_pixmap.toImage()
+                board = self.background if isinstance(self.background, QColor) else None
+                future = self._save_pool.submit(
+                    _save_vector, path, self.save_format, self.imageDraw.size(), items, base, screenshot, board)
+            else:
+                future = self._save_pool.submit(_save_image, self.captureScreen(), path, self.save_format, self.save_quality)
+            # an exception in the encoder is reported as a failed save too
+            future.add_done_callback(
+                lambda future: self.imageSaved.emit(path, future.exception() is None and future.result()))
         return _saveDrawing
 
+    def _imageSaved(self, path, ok):
+        if ok:
+            self._notify(f'Saved {path}')
+        else:
+            print(f'ERROR: Cannot save {path}')
+            self._notify(f'Cannot save {path}')
+
+    def _notify(self, text, timeout=2500):
+        '''Shows `text` at the bottom of the window for `timeout` ms.'''
+        label = QLabel(text, self)
+        label.setStyleSheet('color: white; background-color: rgba(0, 0, 0, 160); padding: 8px; border-radius: 4px;')
+        label.adjustSize()
+        label.move((self.width() - label.width()) // 2, self.height() - label.height() - 40)
+        label.show()
+        QtCore.QTimer.singleShot(timeout, label.deleteLater)
+
     def colorPicker(self):
         def _colorPicker():
             color = QColorDialog.getColor()
@@ -830,173 +2520,338 @@ setattr(self, 'drawChart', drawChart)
 
         
     def scaleCoords(self, coords):
+        point = self.scaleCoordsF(coords)
+        return QtCore.QPoint(int(point.x()), int(point.y()))
+
+    def scaleCoordsF(self, coords):
+        x_scale, y_scale = self._canvas_scale
+        return QtCore.QPointF(coords.x()*x_scale, coords.y()*y_scale)
+
+    def _updateMapping(self):
+        '''Precomputes the window to canvas scale, it is 1 unless the window
+        was resized after the canvas was created.'''
         canvas_size = self.imageDraw.size()
         window_size = self.size()
-        x_scale = canvas_size.width() / window_size.width()
-        y_scale = canvas_size.height() / window_size.height()
-        return QtCore.QPoint(int(coords.x()*x_scale), int(coords.y()*y_scale))
+        self._canvas_scale = (canvas_size.width() / window_size.width(), canvas_size.height() / window_size.height())
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.imageDraw is not None:
+            self._updateMapping()
+
+    def canvasToWindowRect(self, rect):
+        x_scale, y_scale = 1 / self._canvas_scale[0], 1 / self._canvas_scale[1]
+        return QtCore.QRect(
+            int(rect.x()*x_scale), int(rect.y()*y_scale),
+            int(rect.width()*x_scale) + 2, int(rect.height()*y_scale) + 2
+        )
 
-    def paintEvent(self, event):
-        self._setupTools()
+    def _windowToCanvasRect(self, rect):
+        return QtCore.QRect(self.scaleCoords(rect.topLeft()), self.scaleCoords(rect.bottomRight()))
 
-        qp = QtGui.QPainter(self.imageDraw)
-        canvasPainter = QtGui.QPainter(self)
+    def updateCanvasRect(self, rect):
+        if rect is None:
+            self.update()
+        else:
+            self.update(self.canvasToWindowRect(rect))
+
+    def _toolRect(self, begin, end):
+        '''Canvas area touched by the current tool between `begin` and `end` (None = everything).'''
+        if self.curr_method in ['drawPath', 'drawEraser']:
+            pen = self._getEraserPen() if self.curr_method == 'drawEraser' else self.curr_pen
+            m = _pen_margin(pen.widthF())
+            return QtCore.QRect(self.lastPoint, end).normalized().adjusted(-m, -m, m, m)
+        elif self.curr_method in ['drawRect', 'drawLine']:
+            m = _pen_margin(self.curr_pen.widthF())
+            return QtCore.QRect(begin, end).normalized().adjusted(-m, -m, m, m)
+        elif self.curr_method in ['drawDot']:
+            m = _pen_margin(self.curr_pen.widthF()) + 10
+            return QtCore.QRect(end, end).adjusted(-m, -m, m, m)
+        elif self.curr_method in ['drawChart'] and self._chart_size is not None:
+            return QtCore.QRect(end, self._chart_size)
+        return None
+
+    def _shapeArgs(self):
+        if self.curr_method in ['drawRect']:
+            return [QtCore.QRect(self.begin, self.end)]
+        elif self.curr_method in ['drawDot']:
+            return [self.end, 10, 10]
+        elif self.curr_method in ['drawLine']:
+            return [self.begin, self.end]
+        elif self.curr_method in ['drawChart']:
+            return [self.end]
 
+    def paintEvent(self, event):
+        timings = self.timings
+        if timings is None:
+            self._paint(event)
+            return
+        start = time.perf_counter()
+        self._paint(event)
+        timings.painted(start, time.perf_counter())
 
+    def _paint(self, event):
+        self._setupTools()
 
-        qp.setCompositionMode(COMPOSITION_MODE['source'])
-        canvasPainter.setCompositionMode(COMPOSITION_MODE['source_over'])
+        dirty = event.rect()
+        canvas_dirty = self._windowToCanvasRect(dirty)
 
-        if BUTTONS['left'] and self.drawing:
-            qp.setPen(self.curr_pen)
-            qp.setBrush(self.curr_br)
-            if self.curr_method in ['drawRect']:
-                qp.setBrush(BRUSHES['no_brush'])
-                self.curr_args = [QtCore.QRect(self.begin, self.end)]
-                qp.drawImage(self.imageDraw.rect(), self.imageDraw_bck, self.imageDraw_bck.rect())
-                
-                getattr(qp, self.curr_method)(*self.curr_args)
-                qp.setBrush(self.curr_br)
-            elif self.curr_method in ['drawDot']:
-                self.curr_args = [self.end, 10, 10]
-                qp.drawImage(self.imageDraw.rect(), self.imageDraw_bck, self.imageDraw_bck.rect())
-                
-                getattr(qp, 'drawEllipse')(*self.curr_args)
-
-            elif self.curr_method in ['drawLine']:
-                qp.setBrush(BRUSHES['no_brush'])
-                self.curr_args = [self.begin, self.end]
-                qp.drawImage(self.imageDraw.rect(), self.imageDraw_bck, self.imageDraw_bck.rect())
-                
-                getattr(qp, self.curr_method)(*self.curr_args)
-                qp.setBrush(self.curr_br)
-
-            elif self.curr_method in ['drawChart']:
-                qp.drawImage(self.imageDraw.rect(), self.imageDraw_bck, self.imageDraw_bck.rect())
-                try:
-                    self.drawChart(qp, self.end)
-                    self.update()
-                except Exception as ex:
-                    self.drawing = False
-                    msgBox = QtWidgets.QMessageBox()
-                    msgBox.setText(str(ex))
-                    msgBox.exec()
-                    
-                    self.curr_method = 'drawPath'
-                    self.update()
-                    return
-
-
-            elif self.curr_method in ['drawPath']:
-                if self.lastPoint != self.end:
-                    qp.setBrush(BRUSHES['no_brush'])
-                    qp.setPen(self.curr_pen)
-                    _path_cubic_to(self.path, self.end, self.end, self.end)
-                    self.curr_args = [self.path]
-                    getattr(qp, self.curr_method)(*self.curr_args)
-                    self.lastPoint = self.end
-                    self.update()
-                    qp.setBrush(self.curr_br)
-
-            elif self.curr_method in ['drawEraser']:
-                if self.lastPoint != self.end:
-                    qp.setBrush(BRUSHES['no_brush'])
-                    qp.setPen(self._getEraserPen(COLORS['transparent']))
-                    _path_cubic_to(self.path, self.end, self.end, self.end)
-                    self.curr_args = [self.path]
-                    getattr(qp, 'drawPath')(*self.curr_args)
-                    self.lastPoint = self.end
-                    self.update()
-                    qp.setBrush(self.curr_br)
-
-        qp.setCompositionMode(COMPOSITION_MODE['source_over'])
-        qp.end()
-        
-        canvasPainter.drawImage(self.rect(), self.background, self.background.rect())
-        canvasPainter.drawImage(self.rect(), self.imageDraw, self.imageDraw.rect())
+        canvasPainter = QtGui.QPainter(self)
         canvasPainter.setCompositionMode(COMPOSITION_MODE['source_over'])
+        canvasPainter.setClipRect(dirty)
+        if self._canvas_scale != (1.0, 1.0):
+            canvasPainter.scale(1 / self._canvas_scale[0], 1 / self._canvas_scale[1])
+        self._paintBackground(canvasPainter, canvas_dirty)
+        self.imageDraw.drawOn(canvasPainter, canvas_dirty)
+        self._paintPreview(canvasPainter, canvas_dirty)
         canvasPainter.end()
 
+        if self.on_first_paint is not None:
+            on_first_paint, self.on_first_paint = self.on_first_paint, None
+            on_first_paint()
+
+    def _paintPreview(self, qp, rect, underlay=None):
+        '''Paints what the current tool has drawn but the canvas does not have
+        yet: the shape being dragged (it goes to the canvas on release) or
+        the tail of a stroke. `underlay` repaints what is under the canvas.'''
+        if not self.drawing:
+            return
+        if self.curr_method in ['drawRect', 'drawDot', 'drawLine', 'drawChart']:
+            self.curr_args = self._shapeArgs()
+            preview = self._sceneItem()
+            if preview is not None:
+                preview.paint(qp)
+        elif self.ink is None and self.curr_method in ['drawPath', 'drawEraser']:
+            self._paintTail(qp, rect, underlay)
+
 
     def mousePressEvent(self, event):
         if hasattr(self, 'exit_button') and event.button() == self.exit_button:
-            sys.exit(0)
+            self.quit_program()
 
         if event.button() == BUTTONS['middle']:
             self.toggle_menus()
             
         if event.button() == BUTTONS['left'] and self.childAt(event.pos()) is None:
             self.drawing = True
+            self.curr_args = None
+            self.pending_points = []
 
         if self.curr_method in ['drawRect', 'drawChart', 'drawLine', 'drawDot']:
-            qp = QtGui.QPainter(self.imageDraw_bck)
-            qp.drawImage(self.imageDraw_bck.rect(), self.imageDraw, self.imageDraw.rect())
-            qp.end()
             self.begin = self.scaleCoords(event.pos())
             self.end = self.scaleCoords(event.pos())
             
         elif self.curr_method in ['drawPath', 'drawEraser']:
-            self.path = QtGui.QPainterPath()
             self.begin = self.scaleCoords(event.pos())
             self.end = self.scaleCoords(event.pos())
-            _path_move_to(self.path, self.begin)
+            self.stroke.begin(self.begin)
             self.lastPoint = self.scaleCoords(event.pos())
-        self.update()
+        self.preview_version += 1
+        self.updateCanvasRect(self._toolRect(self.begin, self.end))
 
     def mouseMoveEvent(self, event):
-        self.end = self.scaleCoords(event.pos())
-        self.update()
+        end = self.scaleCoords(event.pos())
+        if not self.drawing:
+            self.end = end
+            return
+        self._queueInput(end)
+
+    def tabletEvent(self, event):
+        '''Pressure ink for the freehand pen. Other tools get the mouse
+        events Qt makes of the ignored tablet events.'''
+        kind = event.type()
+        if kind == EVENT_TYPES['tabletPress']:
+            pos = _event_pos_f(event)
+            if (self.curr_method != 'drawPath' or event.button() != BUTTONS['left'] or self.drawing
+                    or self.childAt(pos.toPoint()) is not None):
+                event.ignore()
+                return
+            self.drawing = True
+            self.pending_points = []
+            self.ink = InkEngine(self.curr_pen)
+            point = self.scaleCoordsF(pos)
+            self._paintInk(self.ink.begin(point.x(), point.y(), event.pressure()))
+        elif self.ink is None:
+            event.ignore()
+            return
+        elif kind == EVENT_TYPES['tabletMove']:
+            point = self.scaleCoordsF(_event_pos_f(event))
+            self._queueInput((point.x(), point.y(), event.pressure()))
+        elif kind == EVENT_TYPES['tabletRelease']:
+            self.frame_timer.stop()
+            self._flushInput()
+            item = SceneItem('drawInk', Style(self.curr_pen), self.ink.points)
+            self.ink = None
+            self.drawing = False
+            self.scene.add(item)
+            self._journal(SessionJournal.ITEM, item)
+        event.accept()
+
+    def _queueInput(self, sample):
+        if self.timings is not None:
+            self.timings.moved()
+        self.pending_points.append(sample)
+        if not self.frame_timer.isActive():
+            # the first move after a pause is drawn at once, the next ones
+            # are collected until the next frame
+            self._flushInput()
+            self.frame_timer.start(self._frameInterval())
+
+    def _frameInterval(self):
+        rate = self.screen.refreshRate() if self.screen is not None else 0
+        return max(1, int(1000 / (rate if rate > 0 else 60)))
+
+    def _frameTick(self):
+        if not self.pending_points:
+            self.frame_timer.stop()
+        else:
+            self._flushInput()
 
+    def _flushInput(self):
+        '''Feeds all buffered mouse moves to the current tool in one batch.'''
+        points, self.pending_points = self.pending_points, []
+        if not points or not self.drawing:
+            return
+        self.preview_version += 1
+        if self.ink is not None:
+            stamps = []
+            for x, y, pressure in points:
+                stamps += self.ink.extend(x, y, pressure)
+            self._paintInk(stamps)
+            return
+        if self.curr_method in ['drawPath', 'drawEraser']:
+            self._extendStroke(points)
+            return
+        dirty = self._toolRect(self.begin, self.end)
+        self.end = points[-1]
+        new_dirty = self._toolRect(self.begin, self.end)
+        if dirty is None or new_dirty is None:
+            self.update()
+        else:
+            self.updateCanvasRect(dirty.united(new_dirty))
 
-    class drawingHistory(list):
-        def __init__(self, limit=4):
-            self.limit = limit
-            self.current = -1
-        
-        def append(self, el):
-            if self.current < len(self):
-                del self[self.current + 1:]
-                
-            if len(self) >= self.limit:
-                del self[0]
-                self.current = self.limit - 2
-            super().append(el)
-            self.current += 1
-            
-        def extend(self, l):
-            for el in l:
-                self.append(el)
-            
-        def undo(self):
-            if self.current > 0:
-                self.current -= 1
-            return self[self.current]
-        
-        def redo(self):
-            if self.current + 1 < len(self):
-                self.current += 1
-            return self[self.current]
-            
-    def drawPixmap(self, p):
-        qp = QtGui.QPainter(self.imageDraw)
-        qp.setCompositionMode (COMPOSITION_MODE['source'])
-        qp.drawPixmap(self.imageDraw.rect(), p, p.rect())
-        qp.end()
+    def _paintInk(self, stamps):
+        if not stamps:
+            return
+        xs, ys = [stamp[0] for stamp in stamps], [stamp[1] for stamp in stamps]
+        m = self.ink.margin()
+        rect = QtCore.QRect(
+            QtCore.QPoint(math.floor(min(xs)), math.floor(min(ys))),
+            QtCore.QPoint(math.floor(max(xs)), math.floor(max(ys)))
+        ).adjusted(-m, -m, m, m)
+        def _drawStamps(qp):
+            qp.setCompositionMode(COMPOSITION_MODE['source_over'])
+            self.ink.paint(qp, stamps)
+        self.imageDraw.paint(rect, _drawStamps)
+        self.updateCanvasRect(rect)
+
+    def _strokePen(self):
+        if self.curr_method == 'drawEraser':
+            return self._getEraserPen(COLORS['transparent'])
+        return self.curr_pen
+
+    def _extendStroke(self, points):
+        '''Feeds `points` to the stroke and rasterizes the segments that became
+        final. The tail of the stroke is previewed on the window until then.'''
+        pen = self._strokePen()
+        segments = []
+        for point in points:
+            segments += self.stroke.extend(point)
+        self.end = self.lastPoint = points[-1]
+        self._drawSegments(pen, segments)
+        tail, _ = self.stroke.tail()
+        m = _pen_margin(pen.widthF())
+        rect = tail.controlPointRect().toAlignedRect().adjusted(-m, -m, m, m)
+        self.updateCanvasRect(rect if self._tail_rect is None else rect.united(self._tail_rect))
+        self._tail_rect = rect
+
+    def _finishStroke(self):
+        self._drawSegments(self._strokePen(), self.stroke.finish())
+        if self._tail_rect is not None:
+            self.updateCanvasRect(self._tail_rect)
+            self._tail_rect = None
+
+    def _drawSegments(self, pen, segments):
+        '''Rasterizes `segments` into the canvas with one painter per tile
+        and schedules a single repaint of their area.'''
+        if not segments:
+            return
+        rect = segments[0][0].controlPointRect()
+        for segment, _ in segments[1:]:
+            rect = rect.united(segment.controlPointRect())
+        m = _pen_margin(pen.widthF())
+        rect = rect.toAlignedRect().adjusted(-m, -m, m, m)
+        def _draw(qp):
+            qp.setBrush(BRUSHES['no_brush'])
+            for segment, offset in segments:
+                qp.setPen(self.stroke.pen(pen, offset))
+                qp.drawPath(segment)
+        self.imageDraw.paint(rect, _draw)
+        self.updateCanvasRect(rect)
+
+    def _paintTail(self, qp, rect, underlay=None):
+        '''Previews the part of the stroke that is not on the canvas yet.'''
+        tail, offset = self.stroke.tail()
+        if self.curr_method == 'drawEraser':
+            stroker = QtGui.QPainterPathStroker()
+            stroker.setWidth(self._strokePen().widthF())
+            stroker.setCapStyle(PEN_STYLES['roundCap'])
+            stroker.setJoinStyle(PEN_STYLES['roundJoin'])
+            qp.save()
+            qp.setClipPath(stroker.createStroke(tail))
+            if underlay is not None:
+                underlay(qp, rect)
+            elif self.background is None:
+                qp.setCompositionMode(COMPOSITION_MODE['source'])
+                qp.fillRect(rect, COLORS['transparent'])
+            else:
+                self._paintBackground(qp, rect)
+            qp.restore()
+        else:
+            qp.setPen(self.stroke.pen(self.curr_pen, offset))
+            qp.setBrush(BRUSHES['no_brush'])
+            qp.drawPath(tail)
 
-        qp2 = QtGui.QPainter(self.imageDraw_bck)
-        qp2.setCompositionMode (COMPOSITION_MODE['source'])
-        qp2.drawPixmap(self.imageDraw_bck.rect(), p, p.rect())
-        qp2.end()
+
+    def _renderScene(self, rect):
+        self.scene.render(self.imageDraw, rect)
+        self.updateCanvasRect(rect)
 
     def undo(self):
-        p = self.history.undo()
-        self.drawPixmap(p)
-        self.update()
+        if self.drawing:
+            return
+        dirty = self.scene.undo()
+        if dirty is not None:
+            self._journal(SessionJournal.UNDO)
+            self._renderScene(dirty)
 
     def redo(self):
-        p = self.history.redo()
-        self.drawPixmap(p)
-        self.update()
+        if self.drawing:
+            return
+        dirty = self.scene.redo()
+        if dirty is not None:
+            self._journal(SessionJournal.REDO)
+            self._renderScene(dirty)
+
+    def _journal(self, kind, value=None):
+        if self.journal is not None:
+            self.journal.append(kind, value)
+
+    def _replay(self, records):
+        '''Rebuilds the scene and the board from journal records.'''
+        for kind, value in records:
+            if kind == SessionJournal.ITEM:
+                self.scene.add(value)
+            elif kind == SessionJournal.UNDO:
+                self.scene.undo()
+            elif kind == SessionJournal.REDO:
+                self.scene.redo()
+            elif kind == SessionJournal.BOARD:
+                if value is None:
+                    self._clearBackground()
+                else:
+                    self.setupBoard(value)()
+        self._renderScene(self.imageDraw.rect())
 
     def hide_menus(self):
         for toolbar in self.toolBars:
@@ -1014,131 +2869,227 @@ setattr(self, 'drawChart', drawChart)
         self.hidden_menus = not self.hidden_menus
 
     def quit_program(self):
+        if self.recorder is not None and self.recorder.active:
+            self.toggleRecording()
         sys.exit(0)
 
+    def _sceneItem(self):
+        '''Vector record of what the current tool has drawn on the canvas.'''
+        if self.curr_method in ['drawPath', 'drawEraser']:
+            if len(self.stroke.points) < 4:
+                return None
+            if self.curr_method == 'drawEraser':
+                style = Style(self._getEraserPen(COLORS['transparent']))
+            else:
+                style = Style(self.curr_pen)
+            return SceneItem(self.curr_method, style, self.stroke.points)
+        if self.curr_args is None:
+            return None
+        if self.curr_method == 'drawRect':
+            rect = self.curr_args[0]
+            points = [rect.left(), rect.top(), rect.right(), rect.bottom()]
+        elif self.curr_method == 'drawLine':
+            begin, end = self.curr_args
+            points = [begin.x(), begin.y(), end.x(), end.y()]
+        elif self.curr_method == 'drawDot':
+            points = [self.curr_args[0].x(), self.curr_args[0].y()]
+        elif self.curr_method == 'drawChart':
+            points = [self.curr_args[0].x(), self.curr_args[0].y()]
+            return SceneItem(self.curr_method, None, points, self._chart_image)
+        else:
+            return None
+        return SceneItem(self.curr_method, Style(self.curr_pen), points)
+
     def mouseReleaseEvent(self, event):
         if event.button() == BUTTONS['left'] and self.drawing == True:
+            self.frame_timer.stop()
+            self._flushInput()
+            if self.curr_method in ['drawPath', 'drawEraser']:
+                self._finishStroke()
+            elif self.curr_method in ['drawRect', 'drawDot', 'drawLine', 'drawChart']:
+                # the shape where the last move left it, it may not be painted yet
+                self.curr_args = self._shapeArgs()
             self.drawing = False
-            self.path = None
 
             self.begin = self.scaleCoords(event.pos())
             self.end = self.scaleCoords(event.pos())
 
-            self.update()
-            p = QPixmap()
-            p.convertFromImage(self.imageDraw)
-            self.history.append(p)
+            item = self._sceneItem()
+            if item is not None:
+                if self.curr_method in ['drawRect', 'drawDot', 'drawLine', 'drawChart']:
+                    self.imageDraw.paint(item.bounds, item.paint)
+                    self.updateCanvasRect(item.bounds)
+                self.scene.add(item)
+                self._journal(SessionJournal.ITEM, item)
 
 
     def setupBoard(self, color):
         def _setupBoard():
-            self.background.fill(color)
+            self.background = QColor(color)
+            self._journal(SessionJournal.BOARD, self.background)
             self.update()
         return _setupBoard
 
 class ScreenshotError(Exception):
     pass
 
-def _get_screenshots_grim(screens):
-    pixmaps = []
-    for idx, screen in enumerate(screens):
-        # name = s.name()
-        screen_geom = QDesktopWidget().screenGeometry(idx)
-        x = screen_geom.x()
-        y = screen_geom.y()
-        w = screen_geom.width()
-        h = screen_geom.height()
-        
-        try:
-            subprocess.run(
-                f'grim -g "{x},{y} {w}x{h}" "./~screen{idx}.png"', 
-                check=True,
-                shell=True,
-                stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-            )
-            
-            pixmap = QPixmap(f'./~screen{idx}.png')
-            pixmaps.append((
-                screen,
-                screen_geom,
-                pixmap
-            ))
-        except subprocess.CalledProcessError as e:
-            raise ScreenshotError('Grim is not available')
-    for idx in range(len(screens)):
+def _image_from_ppm(data):
+    '''QImage of binary PPM (P6, 8 bit) data.'''
+    fields, pos, size = [], 0, len(data)
+    while len(fields) < 4:
+        while pos < size and data[pos:pos+1].isspace():
+            pos += 1
+        if pos >= size:
+            raise ScreenshotError('Truncated PPM header')
+        if data[pos:pos+1] == b'#':
+            pos = data.find(b'\n', pos)
+            if pos < 0:
+                raise ScreenshotError('Truncated PPM header')
+            continue
+        end = pos
+        while end < size and not data[end:end+1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    try:
+        magic, width, height, maxval = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+    except ValueError:
+        raise ScreenshotError('Invalid PPM header')
+    if magic != b'P6' or maxval != 255 or width <= 0 or height <= 0 or size < pos + 1 + 3*width*height:
+        raise ScreenshotError('Unsupported PPM data')
+    pixels = memoryview(data)[pos+1:pos+1+3*width*height]
+    # copy, the QImage would otherwise point into `data`
+    return QtGui.QImage(pixels, width, height, 3*width, IMAGE_FORMATS['RGB888']).copy()
+
+
+def _screenshot_grim(idx, screen_geom):
+    x = screen_geom.x()
+    y = screen_geom.y()
+    w = screen_geom.width()
+    h = screen_geom.height()
+    try:
+        # PPM on stdout, no PNG encoding and no temporary file
+        result = subprocess.run(
+            ['grim', '-g', f'{x},{y} {w}x{h}', '-t', 'ppm', '-'],
+            check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise ScreenshotError('Grim is not available')
+    return _image_from_ppm(result.stdout)
+
+
+# waits before re-reading a screenshot file that was not complete yet
+PILLOW_RETRY_DELAYS = (0.05, 0.1, 0.2, 0.4, 0.8)
+
+
+def _grab_pillow(bbox):
+    from PIL import ImageGrab, Image, UnidentifiedImageError
+    try:
+        return ImageGrab.grab(bbox=bbox, xdisplay="")
+    except UnidentifiedImageError as e:
+        paths = [el for el in e.args[0].split("'") if el.endswith('.png')]
+        if not paths:
+            raise ScreenshotError('Pillow problem')
+    except Exception as e:
+        raise ScreenshotError('Pillow problem')
+    # the screenshot tool may still be writing the whole-desktop file
+    for delay in PILLOW_RETRY_DELAYS:
+        time.sleep(delay)
         try:
-            os.remove(f'./~screen{idx}.png')
-        except FileNotFoundError:
+            with Image.open(paths[0]) as img:
+                return img.crop(bbox)
+        except (OSError, UnidentifiedImageError):
             pass
-    return pixmaps
+    raise ScreenshotError('Pillow problem')
 
 
-def _grab_screen(screen_idx, screen):
-    if pyqt_version == 5:
-        screen_geom = QDesktopWidget().screenGeometry(screen_idx)
-    else:
-        screen_geom = QGuiApplication.screens()[screen_idx].geometry()
-
-    return (
-        screen_geom, 
-        screen.grabWindow(
-            0, 
-            screen_geom.x(), 
-            screen_geom.y(), 
-            screen.size().width(), 
-            screen.size().height()
+def _screenshots_pillow(geometries):
+    '''Grabs the bounding box of all `geometries` with one Pillow call and
+    returns {idx: QImage}. The images are views into one shared buffer.'''
+    desktop = functools.reduce(QtCore.QRect.united, geometries.values())
+    img = _grab_pillow((desktop.left(), desktop.top(), desktop.right()+1, desktop.bottom()+1))
+    if img.size != (desktop.width(), desktop.height()):
+        raise ScreenshotError('Pillow problem')
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    # packed as native endian 0xffRRGGBB words, Qt's RGB32 that QPixmap
+    # takes without converting
+    data = memoryview(img.tobytes('raw', 'BGRX' if sys.byteorder == 'little' else 'XRGB'))
+    stride = 4 * img.size[0]
+    del img
+    images = {}
+    for idx, screen_geom in geometries.items():
+        x, y = screen_geom.x() - desktop.x(), screen_geom.y() - desktop.y()
+        # the QImage keeps a reference to the memoryview
+        images[idx] = QtGui.QImage(
+            data[y*stride + 4*x:], screen_geom.width(), screen_geom.height(), stride, IMAGE_FORMATS['RGB32']
         )
-    )
-    
+    return images
 
-def _get_screenshots_pyqt(screens):
-    screenshots = []
-    for screen_idx, screen in enumerate(screens):
-        screen_geom, screen_pixmap = _grab_screen(screen_idx, screen)
-        screenshots.append([screen, screen_geom, screen_pixmap])
-    return screenshots
 
+def _screen_geometry(screen_idx, screen):
+    if pyqt_version == 5:
+        return QDesktopWidget().screenGeometry(screen_idx)
+    return screen.geometry()
+
+
+def _thumbnail(image, width):
+    if image is None or image.isNull():
+        return None
+    return image.scaledToWidth(width, TRANSFORMATIONS['smooth'])
+
+
+def _pixels(image):
+    '''NumPy uint32 view of a 32 bit QImage (height x width), no copy.'''
+    import numpy as np
+    bits = image.constBits()
+    bits.setsize(image.height() * image.bytesPerLine())
+    rows = np.frombuffer(bits, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+    return rows[:, :image.width()]
+
+
+def _are_blank(images, step=16, rows=256):
+    '''True when all pixels of all images have the same value. A sparse grid
+    of pixels is compared first, so real screenshots return after a few
+    hundred samples; only blank-looking ones are scanned in full, a block
+    of `rows` rows at a time.'''
+    images = [
+        image if image.depth() == 32 else image.convertToFormat(IMAGE_FORMATS['ARGB32'])
+        for image in images if not image.isNull()
+    ]
+    if not images:
+        return True
+    views = [_pixels(image) for image in images]
+    value = views[0][0, 0]
+    for view in views:
+        if (view[::step, ::step] != value).any():
+            return False
+    for view in views:
+        for top in range(0, view.shape[0], rows):
+            if (view[top:top+rows] != value).any():
+                return False
+    return True
 
-def _get_screenshots_pillow(screens):
-    from PIL import ImageGrab, Image, UnidentifiedImageError
-    from time import sleep
-    screenshots = []
-    for idx, screen in enumerate(screens):
-        screen_geom = QDesktopWidget().screenGeometry(idx)
-        try:
-            img = ImageGrab.grab(
-                bbox=(
-                    screen_geom.x(), screen_geom.y(), 
-                    screen_geom.x()+screen.size().width(), screen_geom.y()+screen.size().height()
-                ), 
-                xdisplay=""
-            )
-        except UnidentifiedImageError as e:
-            sleep(1)
-            try:
-                img = [el for el in e.args[0].split("'") if el.endswith('.png')][0]
-                img = Image.open(img)
-                img = img.crop((screen_geom.x(), screen_geom.y(), screen_geom.x()+screen.size().width(), screen_geom.y()+screen.size().height()))
-            except Exception as e:
-                raise ScreenshotError('Pillow problem')
-        except Exception as e:
-            raise ScreenshotError('Pillow problem')
-        img = img.convert('RGB')
-        data = img.tobytes('raw', 'RGB')
-        qim = QtGui.QImage(data, img.size[0], img.size[1], QtGui.QImage.Format_RGB888)
-        screen_pixmap = QtGui.QPixmap.fromImage(qim)
-        screenshots.append([screen, screen_geom, screen_pixmap])
-    return screenshots
+
+def _capture_screens(capture, geometries, thumbnail_width=None):
+    '''Runs `capture(idx, screen_geom)` for every screen on a thread pool.
+    Returns [(image, thumbnail)], thumbnails are scaled in the workers too.'''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _capture(item):
+        idx, screen_geom = item
+        image = capture(idx, screen_geom)
+        return image, thumbnail_width and _thumbnail(image, thumbnail_width)
+
+    if len(geometries) == 1:
+        return [_capture(next(iter(geometries.items())))]
+    with ThreadPoolExecutor(max_workers=len(geometries)) as pool:
+        return list(pool.map(_capture, geometries.items()))
 
 
 def _is_grim_installed():
-    try:
-        subprocess.run('grim -h2', shell=True, 
-            stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-            check=True)
-        return True
-    except:
-        return False
+    return shutil.which('grim') is not None
     
 
 def _is_pillow_installed():
@@ -1149,14 +3100,27 @@ def _is_pillow_installed():
         return False
 
 
-def _get_screens(app):
+def _get_screens(app, indexes=None, thumbnail_width=None):
+    '''Captures the screens with the given indexes (all by default) and
+    returns [screen, screen_geom, image, thumbnail] for each of them. The
+    images are QImages so that workers can make them; thumbnails are only
+    made when `thumbnail_width` is set.'''
     screens = app.screens()
     if len(screens) < 1:
         raise ScreenshotError('No screens found')
-    
+    if indexes is None:
+        indexes = range(len(screens))
+    geometries = {idx: _screen_geometry(idx, screens[idx]) for idx in indexes}
+
+    def _result(images):
+        return [
+            [screens[idx], geometries[idx], image, thumbnail]
+            for idx, (image, thumbnail) in zip(geometries, images)
+        ]
+
     try:
         if _is_grim_installed():
-            return _get_screenshots_grim(app.screens())
+            return _result(_capture_screens(_screenshot_grim, geometries, thumbnail_width))
         else:
             raise ScreenshotError('Grim problem')
     except ScreenshotError as e:
@@ -1164,21 +3128,27 @@ def _get_screens(app):
 
     try:
         if _is_pillow_installed():
-            return _get_screenshots_pillow(app.screens())
+            images = _screenshots_pillow(geometries)
+            return _result(_capture_screens(lambda idx, _: images[idx], geometries, thumbnail_width))
         else:
             raise ScreenshotError('Pillow problem')
     except ScreenshotError as e:
         pass
 
     try:
-        screenshots = _get_screenshots_pyqt(app.screens())
-        imgs = [screenshot[-1].toImage() for screenshot in screenshots]
-        pxls = [img.pixel(i, j) for img in imgs for i in range(img.width()) for j in range(img.height())]
-        if [next(g, f := next(g, g)) == f for g in [groupby(pxls)]][0]:
+        # QScreen.grabWindow has to run on the GUI thread
+        images = []
+        for idx, screen_geom in geometries.items():
+            image = screens[idx].grabWindow(
+                0, screen_geom.x(), screen_geom.y(), screen_geom.width(), screen_geom.height()
+            ).toImage()
+            images.append((image, thumbnail_width and _thumbnail(image, thumbnail_width)))
+        if _are_blank([image for image, _ in images]):
             print('Warning: All screens seems to be blank (e.g. black). It means your system configuration may not be supported.')
-        return screenshots
+        return _result(images)
     except:
         print('Warning: Unable to take screenshots of your screens. Your system configuration may not be supported.')
+        return _result([(None, None)] * len(geometries))
 
 
 def _is_transparency_supported():
@@ -1196,11 +3166,11 @@ def _is_transparency_supported():
 
 def show_screen_selection(screens):
     number_of_screens = len(screens)
-    def _getScreenButton(pixmap, label):
+    def _getScreenButton(thumbnail, label):
         btn = QPushButton()
-        ico = QIcon(pixmap)
-        btn.setIcon(ico)
-        btn.setIconSize(QSize(int(160), int(160//(pixmap.rect().width()/pixmap.rect().height()))))
+        if thumbnail is not None:
+            btn.setIcon(QIcon(QPixmap.fromImage(thumbnail)))
+            btn.setIconSize(QSize(int(160), int(160//(thumbnail.width()/thumbnail.height()))))
 
         shad = QtWidgets.QGraphicsDropShadowEffect()
         shad.setOffset(-10, 10)
@@ -1225,9 +3195,9 @@ def show_screen_selection(screens):
         return act
 
     for idx, scr in enumerate(screens):
-        screen, screen_geom, screen_pixmap = scr
+        screen, screen_geom, image, thumbnail = scr
         label = f'Screen {idx+1}' if idx > 0 else f'Main screen'
-        btn = _getScreenButton(screen_pixmap, label)
+        btn = _getScreenButton(thumbnail, label)
         btn.released.connect(_getBtnAction(idx+1))
         dlg.layout.addWidget(btn , 1, idx)
     dlg.setLayout(dlg.layout)
@@ -1253,9 +3223,41 @@ def _setPalette(app):
     app.setStyle("Fusion")
 
 
+class _StartupProfiler(object):
+    '''Collects the duration of startup phases for --profile-startup.'''
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = []
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - started)
+
+    def report(self):
+        if not self.enabled:
+            return
+        print('Startup profile:')
+        for name, seconds in self.phases:
+            print(f'  {name:<28} {seconds*1000:9.1f} ms')
+        print(f'  {"total":<28} {sum(seconds for _, seconds in self.phases)*1000:9.1f} ms')
+
+
+_IMPORT_FINISHED = time.perf_counter()
+
 def main():
     import argparse
 
+    if getattr(sys, 'frozen', False):
+        # recording workers are spawned from the frozen executable
+        from multiprocessing import freeze_support
+        freeze_support()
+
     parser = argparse.ArgumentParser(description='Process some integers.')
     parser.add_argument('-v', '--version', dest='version', action='version', version=f'Version: {__version__}')
     parser.add_argument('-1', nargs='?', type=int, dest='screen', const='0')
@@ -1263,35 +3265,69 @@ def main():
     parser.add_argument('-3', nargs='?', type=int, dest='screen', const='2')
     parser.add_argument('-t', '--transparent', dest='transparent', help='Force transparent background. If you are sure your WM support it.', action='store_true')
     parser.add_argument('-c', '--config', type=str, dest='config', help='Path to config file', default='utils/config.ini')
+    parser.add_argument('--restore', dest='restore', help='Restore the drawings of the previous session.', action='store_true')
+    parser.add_argument('--profile-startup', dest='profile_startup', help='Print how long each startup phase takes.', action='store_true')
 
     args = parser.parse_args()
 
-    app = QApplication(sys.argv)
-    _setPalette(app)
+    profiler = _StartupProfiler(args.profile_startup)
+    profiler.add('imports', _IMPORT_FINISHED - _IMPORT_STARTED)
+    _warn_if_pyside6()
+
+    with profiler.phase('QApplication'):
+        # Qt would merge the mouse moves queued between two event loop
+        # iterations into the last one, strokes need every sample (they are
+        # batched per display frame by the window instead)
+        QApplication.setAttribute(APP_ATTRS['compressHighFrequencyEvents'], False)
+        app = QApplication(sys.argv)
+        _setPalette(app)
 
     number_of_screens = len(app.screens())
+    select_screen = number_of_screens > 1 and args.screen is None
+    if args.screen is None:
+        args.screen = 0
+    if args.screen >= number_of_screens:
+        raise Exception(f'Error: You don\'t have so many screens ({args.screen+1}). Try lower number.')
 
-    screens = _get_screens(app)
+    # without the selection dialog only the requested screen is captured
+    with profiler.phase('_get_screens'):
+        if select_screen:
+            screens = _get_screens(app, thumbnail_width=int(160*app.devicePixelRatio()))
+        else:
+            screens = _get_screens(app, [args.screen])
     
-    if number_of_screens > 1 and args.screen is None:
+    if select_screen:
         args.screen = show_screen_selection(screens)
         if args.screen == 0 or args.screen is None:
             print('No screen chosen, exiting.')
             sys.exit(0)
         else:
             args.screen -= 1
-    elif args.screen is None:
-        args.screen = 0
-        
-    if args.screen >= len(screens):
-        raise Exception(f'Error: You don\'t have so many screens ({args.screen+1}). Try lower number.')
+        screens = [screens[args.screen]]
     
-    screen, screen_geom, pixmap = screens[args.screen]
+    # drop the other captures before the window allocates its canvas
+    screen, screen_geom, image, _ = screens.pop()
+    pixmap = None if image is None or image.isNull() else QPixmap.fromImage(image)
+    del image
     
-    use_transparency = args.transparent or _is_transparency_supported()
+    with profiler.phase('_is_transparency_supported'):
+        use_transparency = args.transparent or _is_transparency_supported()
     
-    window = ScreenPenWindow(screen=screen, screen_geom=screen_geom, pixmap=pixmap,
-                             transparent_background=use_transparency, config_file=args.config)
+    with profiler.phase('ScreenPenWindow.__init__'):
+        try:
+            journal = SessionJournal.open(_cache_dir(), restore=args.restore)
+        except OSError as ex:
+            print(f'WARNING: Cannot open the session journal, drawings will not be restorable: {ex}')
+            journal = None
+        window = ScreenPenWindow(screen=screen, screen_geom=screen_geom, pixmap=pixmap,
+                                 transparent_background=use_transparency, config_file=args.config,
+                                 journal=journal)
+    if args.profile_startup:
+        window_created = time.perf_counter()
+        def _firstPaint():
+            profiler.add('first paint', time.perf_counter() - window_created)
+            profiler.report()
+        window.on_first_paint = _firstPaint
     sys.exit(_execute_dialog(app))
 
 if __name__ == '__main__':